@@ -0,0 +1,43 @@
+"""
+Measures AES-CBC encrypt and decrypt throughput in memory for every available crypto backend and a range of chunk
+sizes, to tell whether the CPU or the network bounds `db import`, `db export` and `backup download`.
+
+Usage: python benchmarks/crypto.py [megabytes] [chunk size in bytes ...]
+"""
+from __future__ import absolute_import
+
+import os, sys, time
+from StringIO import StringIO
+
+from catalyze.helpers import AESCrypto
+
+def throughput(func, size):
+    started = time.time()
+    func()
+    return size / (time.time() - started) / 1024 / 1024
+
+def main(megabytes = 64, chunk_sizes = (24 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024)):
+    data = os.urandom(megabytes * 1024 * 1024)
+    key, iv = os.urandom(32), os.urandom(AESCrypto.BLOCK_SIZE)
+    reference = None
+    print("%-14s %12s %16s %16s" % ("backend", "chunk", "encrypt (MB/s)", "decrypt (MB/s)"))
+    for backend in AESCrypto.available_backends():
+        for chunk_size in chunk_sizes:
+            encrypted = StringIO()
+            encryption = AESCrypto.Encryption(key, iv, backend = backend, chunk_size = chunk_size)
+            encrypt_rate = throughput(lambda: encryption.encrypt(StringIO(data), encrypted), len(data))
+            ciphertext = encrypted.getvalue()
+            if reference is None:
+                reference = ciphertext
+            elif ciphertext != reference:
+                sys.exit("%s produced different ciphertext" % (backend,))
+            def decrypt():
+                cipher = AESCrypto.new_cipher(key, iv, backend)
+                for offset in range(0, len(ciphertext), chunk_size):
+                    cipher.decrypt(ciphertext[offset:offset + chunk_size])
+            decrypt_rate = throughput(decrypt, len(ciphertext))
+            print("%-14s %12d %16.1f %16.1f" % (backend, chunk_size, encrypt_rate, decrypt_rate))
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*([args[0]] if args else []) + ([args[1:]] if len(args) > 1 else []))
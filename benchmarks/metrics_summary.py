@@ -0,0 +1,59 @@
+"""
+Compares the row-by-row metrics formatter against --summary on a synthetic environment.
+
+Usage: python benchmarks/metrics_summary.py [services] [jobs per service] [minutes]
+"""
+from __future__ import absolute_import
+
+import os, sys, time, random
+
+import catalyze
+catalyze.init_cli()
+from catalyze.commands import metrics
+
+def build_environment(service_count, job_count, mins):
+    data = []
+    for s in range(service_count):
+        jobs = []
+        for j in range(job_count):
+            jobs.append({
+                "id": "job-%d-%d" % (s, j),
+                "type": "deploy",
+                "metrics": [{
+                    "ts": 1440000000 + 60 * m,
+                    "cpu": {"usage": random.randint(0, 60 * 1000000000)},
+                    "network": {
+                        "rx_bytes": {"ave": random.randint(0, 1 << 20)},
+                        "tx_bytes": {"ave": random.randint(0, 1 << 20)}
+                    },
+                    "memory": {"ave": random.randint(1 << 20, 1 << 30)},
+                    "diskio": {"read": random.randint(0, 1 << 24), "write": random.randint(0, 1 << 24)}
+                } for m in range(mins)]
+            })
+        data.append({"serviceId": "svc-%d" % (s,), "serviceName": "service%02d" % (s,), "jobs": jobs})
+    return data
+
+def timed(transformer, data):
+    transformer.set_group_mode()
+    start = time.time()
+    transformer.transform(data)
+    return time.time() - start
+
+def main(service_count = 10, job_count = 2, mins = 1440):
+    data = build_environment(service_count, job_count, mins)
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        rows = timed(metrics.TextTransformer(), data)
+        summary = timed(metrics.SummaryTransformer(), data)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    print("samples:      %d" % (service_count * job_count * mins,))
+    print("backend:      %s" % ("numpy" if metrics.numpy is not None else "array",))
+    print("row-by-row:   %.3fs" % (rows,))
+    print("--summary:    %.3fs" % (summary,))
+    print("speedup:      %.1fx" % (rows / summary,))
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
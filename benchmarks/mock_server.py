@@ -0,0 +1,435 @@
+"""
+A local stand-in for the Catalyze BaaS and PaaS APIs and the object store, for benchmarking the CLI offline.
+
+Serves the routes used by catalyze/helpers (auth, environments, services, jobs, tasks, pods, environment variables,
+backups, imports, logs and metrics) from one in-memory environment, plus /objects/<name> for uploads and downloads.
+Console websockets are not emulated.
+
+Usage: python benchmarks/mock_server.py [--port 8777] [--latency 0.05] [--bandwidth 10485760] [--error-rate 0.0]
+                                        [--backup-size 10485760] [--environments 1] [--jobs 0] [--tls]
+
+Point the CLI at it with --baas-host http://127.0.0.1:8777 --paas-host http://127.0.0.1:8777. With --tls the server
+speaks HTTPS with a throwaway self-signed certificate, so also pass --skip-validation.
+JSON GET responses carry an ETag and are answered with 304 Not Modified when it is sent back in If-None-Match.
+GET /_stats returns request counts, connections accepted and bytes transferred since the last POST /_reset.
+"""
+from __future__ import absolute_import
+
+import base64, binascii, gzip, hashlib, io, json, optparse, os, random, re, shutil, socket, ssl, struct, sys, tempfile, threading, time, urlparse, uuid
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+from Crypto.Cipher import AES
+
+ENV_ID = "env-bench"
+ENV_NAME = "bench"
+POD_ID = "pod-bench"
+
+KEY = os.urandom(32)
+IV = os.urandom(AES.block_size)
+# every job is given these keys, so the backup and the logs of any task decrypt with them
+KEYS = {"key": base64.b64encode(binascii.hexlify(KEY)), "iv": base64.b64encode(binascii.hexlify(IV))}
+
+def encrypt(plaintext):
+    """Encrypts like the backup service: an <Q original size header, then AES-CBC over the zero-padded data."""
+    padded = plaintext + b"\0" * (-len(plaintext) % AES.block_size)
+    return struct.pack("<Q", len(plaintext)) + AES.new(KEY, AES.MODE_CBC, IV).encrypt(padded)
+
+def build_metrics(mins, jobs):
+    now = int(time.time())
+    return [{
+        "id": job_id,
+        "type": "deploy",
+        "metrics": [{
+            "ts": now - 60 * (mins - m),
+            "cpu": {"usage": random.randint(0, 60 * 1000000000)},
+            "network": {"rx_bytes": {"ave": random.randint(0, 1 << 20)}, "tx_bytes": {"ave": random.randint(0, 1 << 20)}},
+            "memory": {"ave": random.randint(1 << 20, 1 << 30)},
+            "diskio": {"read": random.randint(0, 1 << 24), "write": random.randint(0, 1 << 24)}
+        } for m in range(mins)]
+    } for job_id in jobs]
+
+class State(object):
+    def __init__(self, options):
+        self.options = options
+        self.lock = threading.Lock()
+        self.objects = {}
+        self.jobs = {}
+        self.tasks = {}
+        self.users = ["user-bench"]
+        self.environments = [{"environmentId": ENV_ID, "state": "running", "podId": POD_ID, "data": {"name": ENV_NAME}}] + \
+                [{"environmentId": "env-other-%d" % (i,), "state": "running", "podId": POD_ID,
+                    "data": {"name": "other-%d" % (i,), "namespace": "other-%d" % (i,)}} for i in range(options.environments - 1)]
+        self.services = [
+            {"id": "svc-app01", "label": "app01", "type": "code", "size": 1, "name": "code", "source": "git@localhost:app01.git",
+                "build_status": "finished", "deploy_status": "running", "environmentVariables": {"RAILS_ENV": "production"}},
+            {"id": "svc-db01", "label": "db01", "type": "postgresql", "size": 1, "name": "postgresql", "deploy_status": "running"}
+        ]
+        self.objects["backup"] = encrypt(os.urandom(options.backup_size))
+        self.objects["logs"] = encrypt(b"".join([b"log line %d\n" % (i,) for i in range(200)]))
+        self.add_job("svc-db01", "backup", "finished", job_id = "backup-1")
+        # a seeded history, so runs are comparable
+        history = random.Random(0)
+        for i in range(options.jobs):
+            self.add_job(history.choice(self.services)["id"], history.choice(["build", "deploy", "backup", "restore"]),
+                    history.choice(["finished", "finished", "finished", "failed"]),
+                    created_at = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(1420070400 + history.randint(0, 365 * 24 * 60 * 60))))
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = {}
+            self.connections = 0
+            self.bytes_in = 0
+            self.bytes_out = 0
+
+    def count(self, route, bytes_in = 0):
+        with self.lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+            self.bytes_in += bytes_in
+
+    def sent(self, bytes_out):
+        with self.lock:
+            self.bytes_out += bytes_out
+
+    def stats(self):
+        with self.lock:
+            return {"requests": dict(self.requests), "total_requests": sum(self.requests.values()),
+                    "connections": self.connections, "bytes_in": self.bytes_in, "bytes_out": self.bytes_out}
+
+    def add_job(self, svc_id, job_type, status, job_id = None, created_at = "2015-01-01T00:00:00"):
+        job_id = job_id or str(uuid.uuid4())
+        job = {"id": job_id, "type": job_type, "status": status, "serviceId": svc_id, "created_at": created_at,
+                job_type: dict(KEYS)}
+        task_id = "task-" + job_id
+        self.jobs[job_id] = job
+        self.tasks[task_id] = job
+        return task_id, job
+
+    def service(self, svc_id):
+        for service in self.services:
+            if service["id"] == svc_id:
+                return service
+        return None
+
+class MockServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    ssl_context = None
+
+    def get_request(self):
+        sock, address = HTTPServer.get_request(self)
+        with self.state.lock:
+            self.state.connections += 1
+        if self.ssl_context is not None:
+            # the handshake happens on the handler thread, on first read
+            sock = self.ssl_context.wrap_socket(sock, server_side = True, do_handshake_on_connect = False)
+        return sock, address
+
+    def handle_error(self, request, client_address):
+        # clients that hang up without a TLS close_notify are not worth a traceback
+        if not isinstance(sys.exc_info()[1], (ssl.SSLError, socket.error)):
+            HTTPServer.handle_error(self, request, client_address)
+
+    @property
+    def url(self):
+        return "%s://%s:%d" % (("https" if self.ssl_context is not None else "http",) + self.server_address)
+
+def tls_context():
+    """A server context with a throwaway self-signed certificate. TLS 1.0 stays enabled because the CLI pins it."""
+    from OpenSSL import crypto
+    key = crypto.PKey()
+    key.generate_key(crypto.TYPE_RSA, 2048)
+    cert = crypto.X509()
+    cert.get_subject().CN = "127.0.0.1"
+    cert.set_serial_number(1)
+    cert.gmtime_adj_notBefore(0)
+    cert.gmtime_adj_notAfter(24 * 60 * 60)
+    cert.set_issuer(cert.get_subject())
+    cert.set_pubkey(key)
+    cert.sign(key, "sha256")
+    dir = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(dir, "cert.pem"), "wb") as file:
+            file.write(crypto.dump_certificate(crypto.FILETYPE_PEM, cert) + crypto.dump_privatekey(crypto.FILETYPE_PEM, key))
+        context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+        context.set_ciphers("DEFAULT:@SECLEVEL=0")
+        context.load_cert_chain(os.path.join(dir, "cert.pem"))
+    finally:
+        shutil.rmtree(dir)
+    return context
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def do_PUT(self):
+        self.dispatch("PUT")
+
+    def do_DELETE(self):
+        self.dispatch("DELETE")
+
+    def dispatch(self, method):
+        url = urlparse.urlparse(self.path)
+        self.query = dict(urlparse.parse_qsl(url.query))
+        body = self.read_body()
+        if not url.path.startswith("/_"):
+            time.sleep(self.state.options.latency)
+            if random.random() < self.state.options.error_rate:
+                self.state.count("injected error", len(body))
+                return self.send_json({"errors": [{"message": "injected error", "code": 500}]}, 500)
+        for route_method, pattern, handler in ROUTES:
+            match = re.match(pattern + "$", url.path)
+            if route_method == method and match:
+                self.state.count("%s %s" % (method, pattern), len(body))
+                return handler(self, body, *match.groups())
+        self.state.count("%s (unmatched)" % (method,), len(body))
+        self.send_json({"errors": [{"message": "no route for %s %s" % (method, url.path), "code": 404}]}, 404)
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        chunks = []
+        while length > 0:
+            chunk = self.rfile.read(min(length, 64 * 1024))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            length -= len(chunk)
+            self.throttle(len(chunk))
+        return b"".join(chunks)
+
+    def throttle(self, size):
+        if self.state.options.bandwidth > 0:
+            time.sleep(float(size) / self.state.options.bandwidth)
+
+    def send_bytes(self, data, status = 200, content_type = "application/octet-stream", encoding = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        if getattr(self, "etag", None) is not None:
+            self.send_header("ETag", self.etag)
+            self.etag = None
+        if encoding is not None:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        for offset in range(0, len(data), 64 * 1024):
+            chunk = data[offset:offset + 64 * 1024]
+            self.wfile.write(chunk)
+            self.throttle(len(chunk))
+        self.state.sent(len(data))
+
+    def send_json(self, data, status = 200):
+        body = json.dumps(data) if data is not None else b""
+        if self.command == "GET" and status == 200:
+            etag = '"%s"' % (hashlib.md5(body).hexdigest(),)
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.etag = etag
+        if "gzip" in self.headers.get("Accept-Encoding", "") and len(body) > 1024:
+            compressed = io.BytesIO()
+            with gzip.GzipFile(fileobj = compressed, mode = "wb") as file:
+                file.write(body)
+            return self.send_bytes(compressed.getvalue(), status, "application/json", "gzip")
+        self.send_bytes(body, status, "application/json")
+
+    def object_url(self, name):
+        return "%s/objects/%s" % (self.server.url, name)
+
+    # auth
+    def signin(self, body):
+        self.send_json({"sessionToken": "token-bench", "usersId": "user-bench"})
+
+    def verify(self, body):
+        self.send_json({})
+
+    # environments
+    def list_environments(self, body):
+        self.send_json(self.state.environments)
+
+    def retrieve_environment(self, body, env_id):
+        self.send_json({"environmentId": env_id, "state": "running", "podId": POD_ID,
+                "data": {"name": ENV_NAME, "services": self.state.services}})
+
+    def list_users(self, body, env_id):
+        self.send_json({"users": self.state.users})
+
+    def add_user(self, body, env_id, user_id):
+        if user_id not in self.state.users:
+            self.state.users.append(user_id)
+        self.send_json({})
+
+    def remove_user(self, body, env_id, user_id):
+        if user_id in self.state.users:
+            self.state.users.remove(user_id)
+        self.send_json({})
+
+    def environment_metrics(self, body, env_id):
+        mins = int(self.query.get("mins", 1))
+        self.send_json([{"serviceId": svc["id"], "serviceName": svc["label"], "jobs": build_metrics(mins, [svc["id"] + "-job"])} \
+                for svc in self.state.services])
+
+    def service_metrics(self, body, env_id, svc_id):
+        self.send_json({"jobs": build_metrics(int(self.query.get("mins", 1)), [svc_id + "-job"])})
+
+    def pod_metadata(self, body):
+        self.send_json([{"id": POD_ID, "importRequiresLength": True}])
+
+    # services
+    def retrieve_service(self, body, env_id, svc_id):
+        self.send_json(self.state.service(svc_id))
+
+    def list_variables(self, body, env_id, svc_id):
+        self.send_json(self.state.service(svc_id).get("environmentVariables", {}))
+
+    def set_variables(self, body, env_id, svc_id):
+        self.state.service(svc_id).setdefault("environmentVariables", {}).update(json.loads(body))
+        self.send_json({})
+
+    def unset_variable(self, body, env_id, svc_id, key):
+        self.state.service(svc_id).get("environmentVariables", {}).pop(key, None)
+        self.send_json({})
+
+    def start_task(self, body, env_id, svc_id, *args):
+        task_id, job = self.state.add_job(svc_id, "worker", "finished")
+        self.send_json({"taskId": task_id})
+
+    def list_jobs(self, body, env_id, svc_id):
+        self.send_json(dict([(job["id"], job) for job in self.state.jobs.values() if job["serviceId"] == svc_id]))
+
+    def retrieve_job(self, body, env_id, svc_id, job_id):
+        if job_id not in self.state.jobs:
+            return self.send_json({"errors": [{"message": "job not found", "code": 404}]}, 404)
+        self.send_json(self.state.jobs[job_id])
+
+    def retrieve_task(self, body, env_id, task_id):
+        self.send_json(self.state.tasks[task_id])
+
+    def list_backups(self, body, env_id, svc_id):
+        self.send_json(dict([(job["id"], {"created_at": job["created_at"], "status": job["status"]}) \
+                for job in self.state.jobs.values() if job["serviceId"] == svc_id and job["type"] == "backup"]))
+
+    def create_backup(self, body, env_id, svc_id):
+        task_id, job = self.state.add_job(svc_id, "backup", "finished")
+        self.send_json({"taskId": task_id})
+
+    def restore_backup(self, body, env_id, svc_id, backup_id):
+        task_id, job = self.state.add_job(svc_id, "restore", "finished")
+        self.send_json({"taskId": task_id})
+
+    def backup_url(self, body, env_id, svc_id, backup_id):
+        self.send_json({"url": self.object_url("backup")})
+
+    def upload_url(self, body, env_id, svc_id):
+        self.send_json({"url": self.object_url("upload-" + str(uuid.uuid4()))})
+
+    def logs_url(self, body, env_id, svc_id, task_type, job_id):
+        self.send_json({"url": self.object_url("logs")})
+
+    def start_import(self, body, env_id, svc_id):
+        task_id, job = self.state.add_job(svc_id, "restore", "finished")
+        self.send_json({"id": task_id})
+
+    # object store
+    def get_object(self, body, name):
+        if name not in self.state.objects:
+            return self.send_json({"errors": [{"message": "no such object", "code": 404}]}, 404)
+        self.send_bytes(self.state.objects[name])
+
+    def put_object(self, body, name):
+        self.state.objects[name] = body
+        self.send_bytes(b"")
+
+    # control
+    def stats(self, body):
+        self.send_json(self.state.stats())
+
+    def reset(self, body):
+        self.state.reset()
+        self.send_json({})
+
+ENV = "/v1/environments/([^/]+)"
+SVC = ENV + "/services/([^/]+)"
+ROUTES = [
+    ("POST", "/v2/auth/signin", Handler.signin),
+    ("GET", "/v2/auth/verify", Handler.verify),
+    ("GET", "/v1/environments", Handler.list_environments),
+    ("GET", ENV, Handler.retrieve_environment),
+    ("GET", ENV + "/users", Handler.list_users),
+    ("POST", ENV + "/users/([^/]+)", Handler.add_user),
+    ("DELETE", ENV + "/users/([^/]+)", Handler.remove_user),
+    ("GET", ENV + "/metrics", Handler.environment_metrics),
+    ("GET", ENV + "/metrics/([^/]+)", Handler.service_metrics),
+    ("GET", ENV + "/tasks/([^/]+)", Handler.retrieve_task),
+    ("GET", "/v1/pods/metadata", Handler.pod_metadata),
+    ("GET", SVC, Handler.retrieve_service),
+    ("GET", SVC + "/env", Handler.list_variables),
+    ("POST", SVC + "/env", Handler.set_variables),
+    ("DELETE", SVC + "/env/([^/]+)", Handler.unset_variable),
+    ("POST", SVC + "/(rake)/(.+)", Handler.start_task),
+    ("POST", SVC + "/(redeploy)", Handler.start_task),
+    ("POST", SVC + "/(background)", Handler.start_task),
+    ("GET", SVC + "/jobs", Handler.list_jobs),
+    ("GET", SVC + "/jobs/([^/]+)", Handler.retrieve_job),
+    ("GET", SVC + "/backup", Handler.list_backups),
+    ("POST", SVC + "/backup", Handler.create_backup),
+    ("GET", SVC + "/backup/([^/]+)/url", Handler.backup_url),
+    ("GET", SVC + "/restore/url", Handler.upload_url),
+    ("POST", SVC + "/restore/([^/]+)", Handler.restore_backup),
+    ("GET", SVC + "/(backup|restore)/([^/]+)/logs/url", Handler.logs_url),
+    ("POST", SVC + "/db/import", Handler.start_import),
+    ("GET", "/objects/([^/]+)", Handler.get_object),
+    ("PUT", "/objects/([^/]+)", Handler.put_object),
+    ("GET", "/_stats", Handler.stats),
+    ("POST", "/_reset", Handler.reset)
+]
+
+def parse_options(args = None):
+    parser = optparse.OptionParser()
+    parser.add_option("--host", default = "127.0.0.1")
+    parser.add_option("--port", type = "int", default = 8777)
+    parser.add_option("--latency", type = "float", default = 0.0, help = "seconds added to every API request")
+    parser.add_option("--bandwidth", type = "int", default = 0, help = "bytes per second per connection, 0 for unlimited")
+    parser.add_option("--error-rate", type = "float", default = 0.0, help = "fraction of API requests answered with a 500")
+    parser.add_option("--backup-size", type = "int", default = 10 * 1024 * 1024, help = "plaintext size of the served backup")
+    parser.add_option("--environments", type = "int", default = 1, help = "number of environments listed")
+    parser.add_option("--jobs", type = "int", default = 0, help = "number of extra jobs in the services' history")
+    parser.add_option("--tls", action = "store_true", default = False, help = "serve HTTPS with a self-signed certificate")
+    return parser.parse_args(args)[0]
+
+def start(options):
+    """Starts the server on a background thread and returns it."""
+    server = MockServer((options.host, options.port), Handler)
+    server.state = State(options)
+    if options.tls:
+        server.ssl_context = tls_context()
+    thread = threading.Thread(target = server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+if __name__ == "__main__":
+    options = parse_options()
+    server = MockServer((options.host, options.port), Handler)
+    server.state = State(options)
+    if options.tls:
+        server.ssl_context = tls_context()
+    print("Mock Catalyze API listening on " + server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,116 @@
+"""
+End-to-end CLI benchmarks against the local mock API (benchmarks/mock_server.py).
+
+Every command runs as a fresh `python -m catalyze` process, so the wall times include interpreter startup, just
+as a user sees them. For each command the suite reports wall time, API request count, connections opened and the
+bytes moved through the mock server. With --tls the server speaks HTTPS and the suite also reports the client's TLS
+handshakes, how many of them were resumed and the time spent in them.
+
+Usage: python benchmarks/suite.py [--latency 0.05] [--bandwidth 0] [--error-rate 0.0] [--backup-size 10485760]
+                                  [--import-size 10485760] [--repeat 3] [--only import,export,...] [--environments 1] [--jobs 0] [--tls]
+"""
+from __future__ import absolute_import
+
+import json, optparse, os, re, shutil, ssl, subprocess, sys, tempfile, time, urllib2
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import mock_server
+
+def commands(workdir, options):
+    data = os.path.join(workdir, "import.sql")
+    if not os.path.exists(data):
+        with open(data, "wb") as file:
+            file.write(os.urandom(options.import_size))
+    return [
+        ("environments", ["environments"]),
+        ("associate", ["associate", mock_server.ENV_NAME, "app01"]),
+        ("status", ["status"]),
+        ("import", ["db", "import", "db01", data]),
+        ("import-stdin", ["db", "import", "db01", "-"], data),
+        ("export", ["db", "export", "db01", os.path.join(workdir, "export.out")]),
+        ("export-stdout", ["db", "export", "db01", "-"]),
+        ("download", ["backup", "download", "db01", "backup-1", os.path.join(workdir, "download.out")]),
+        ("metrics", ["metrics", "--mins", "1440"]),
+        # the first run fills the local index, later ones are conditional
+        ("jobs-sync", ["jobs", "sync"]),
+        ("jobs-list", ["jobs", "list", "--type", "restore", "--status", "failed", "--since", "2015-06-01"])
+    ]
+
+def call(server_url, path, method = "GET"):
+    request = urllib2.Request(server_url + path, data = b"" if method == "POST" else None)
+    context = ssl._create_unverified_context() if server_url.startswith("https") else None
+    return json.loads(urllib2.urlopen(request, context = context).read() or "null")
+
+def run(name, args, workdir, server_url, stdin = None):
+    call(server_url, "/_reset", "POST")
+    env = dict(os.environ, CATALYZE_USERNAME = "bench", CATALYZE_PASSWORD = "bench", CATALYZE_TLS_STATS = "1")
+    env["PYTHONPATH"] = os.pathsep.join([os.path.dirname(os.path.dirname(os.path.abspath(__file__))), env.get("PYTHONPATH", "")])
+    for variable in ["REQUESTS_CA_BUNDLE", "CURL_CA_BUNDLE"]:
+        # requests lets these override --skip-validation
+        env.pop(variable, None)
+    options = ["--baas-host", server_url, "--paas-host", server_url] + (["--skip-validation"] if server_url.startswith("https") else [])
+    started = time.time()
+    with open(os.devnull, "w") as devnull, open(stdin or os.devnull, "rb") as input, tempfile.TemporaryFile() as errors:
+        code = subprocess.call([sys.executable, "-m", "catalyze"] + options + args,
+                cwd = workdir, env = env, stdin = input, stdout = devnull, stderr = errors)
+        elapsed = time.time() - started
+        errors.seek(0)
+        handshakes = re.search(r"TLS handshakes: (\d+) \((\d+) resumed\) in ([\d.]+) ms", errors.read())
+    stats = call(server_url, "/_stats")
+    # the connection for /_stats itself is not the command's
+    return {"command": name, "exit_code": code, "seconds": elapsed, "requests": stats["total_requests"],
+            "connections": stats["connections"] - 1, "bytes": stats["bytes_in"] + stats["bytes_out"], "routes": stats["requests"],
+            "handshakes": int(handshakes.group(1)) if handshakes else 0, "resumed": int(handshakes.group(2)) if handshakes else 0,
+            "handshake_ms": float(handshakes.group(3)) if handshakes else 0.0}
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("--latency", type = "float", default = 0.0)
+    parser.add_option("--bandwidth", type = "int", default = 0)
+    parser.add_option("--error-rate", type = "float", default = 0.0)
+    parser.add_option("--backup-size", type = "int", default = 10 * 1024 * 1024)
+    parser.add_option("--import-size", type = "int", default = 10 * 1024 * 1024)
+    parser.add_option("--environments", type = "int", default = 1, help = "number of environments the mock server lists")
+    parser.add_option("--jobs", type = "int", default = 0, help = "number of extra jobs in the mock server's history")
+    parser.add_option("--repeat", type = "int", default = 3)
+    parser.add_option("--only", default = None, help = "comma-separated command names")
+    parser.add_option("--json", action = "store_true", default = False, help = "print raw results as JSON")
+    parser.add_option("--tls", action = "store_true", default = False, help = "run the mock server over HTTPS")
+    options = parser.parse_args()[0]
+
+    server_options = mock_server.parse_options(["--port", "0", "--latency", str(options.latency), "--bandwidth", str(options.bandwidth),
+            "--error-rate", str(options.error_rate), "--backup-size", str(options.backup_size),
+            "--environments", str(options.environments), "--jobs", str(options.jobs)] + (["--tls"] if options.tls else []))
+    server = mock_server.start(server_options)
+    server_url = server.url
+
+    workdir = tempfile.mkdtemp()
+    try:
+        subprocess.check_call(["git", "init", "-q", workdir])
+        with open(os.path.join(workdir, ".git", "catalyze-config.json"), "w") as file:
+            json.dump({"token": "token-bench", "user_id": "user-bench", "environmentId": mock_server.ENV_ID, "serviceId": "svc-app01"}, file)
+        selected = options.only.split(",") if options.only else None
+        results = []
+        for command in commands(workdir, options):
+            name, args, stdin = (command + (None,))[:3]
+            if selected is None or name in selected:
+                runs = [run(name, args, workdir, server_url, stdin) for i in range(options.repeat)]
+                best = min(runs, key = lambda result: result["seconds"])
+                best["failures"] = len([result for result in runs if result["exit_code"] != 0])
+                results.append(best)
+    finally:
+        shutil.rmtree(workdir)
+        server.shutdown()
+
+    if options.json:
+        print(json.dumps(results, indent = 2))
+        return
+    print("%-14s %9s %9s %6s %12s %12s %9s" % ("command", "best (s)", "requests", "conns", "bytes", "MB/s", "failures")
+            + (" %17s %13s" % ("tls (resumed)", "handshake ms") if options.tls else ""))
+    for result in results:
+        print("%-14s %9.3f %9d %6d %12d %12.2f %9d" % (result["command"], result["seconds"], result["requests"], result["connections"],
+                result["bytes"], result["bytes"] / result["seconds"] / 1024 / 1024, result["failures"])
+                + (" %17s %13.1f" % ("%d (%d)" % (result["handshakes"], result["resumed"]), result["handshake_ms"]) if options.tls else ""))
+
+if __name__ == "__main__":
+    main()
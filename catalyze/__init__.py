@@ -3,8 +3,9 @@ from __future__ import absolute_import
 cli = None
 
 def init_cli():
-    import click
-    from . import config, output
+    import atexit, click
+    import sys
+    from . import completion, config, output
 
     @click.group("catalyze")
     @click.option("--baas-host", help = "Alternate BaaS API URL")
@@ -12,14 +13,23 @@ def init_cli():
     @click.option("--username", help = "Catalyze Username")
     @click.option("--password", help = "Catalyze Password")
     @click.option("--skip-validation", is_flag = True, help = "Skip certificate validation")
+    @click.option("--limit-rate", default = None, help = "Limit uploads and downloads to this many bytes per second, e.g. 500K or 2M.")
+    @click.option("--output", "output_format", type = click.Choice(["text", "json"]), default = "text", help = "Output format. With 'json', results are printed to stdout as one JSON document per line and all other messages go to stderr.")
     @click.version_option(version = config.version)
-    def inner_cli(baas_host, paas_host, username, password, skip_validation):
+    def inner_cli(baas_host, paas_host, username, password, skip_validation, limit_rate, output_format):
+        output.json_mode = output_format == "json"
+        if limit_rate is not None:
+            from catalyze.helpers import transfer
+            try:
+                config.limit_rate = transfer.parse_rate(limit_rate)
+            except ValueError:
+                raise click.BadParameter("expected a number of bytes per second such as 500K or 2M, got '%s'" % (limit_rate,))
         if baas_host is not None:
             config.baas_host = baas_host
-            output.write("Overriding BaaS URL: " + config.baas_host)
+            output.write("Overriding BaaS URL: " + config.baas_host, stream = sys.stderr)
         if paas_host is not None:
             config.paas_host = paas_host
-            output.write("Overriding PaaS URL: " + config.paas_host)
+            output.write("Overriding PaaS URL: " + config.paas_host, stream = sys.stderr)
         config.username = username
         config.password = password
         if skip_validation:
@@ -30,7 +40,10 @@ def init_cli():
     cli = inner_cli
 
     from catalyze.commands import \
-        associate, backup, console, dashboard, db, environments, metrics, rake, redeploy, status, support_ids, users, variables, worker
+        associate, backup, completion as completion_command, console, dashboard, db, environments, jobs, metrics, rake, redeploy, \
+        status, support_ids, users, variables, worker
+
+    atexit.register(completion.save, cli, config.version)
 
 def run():
     import catalyze.__main__
@@ -1,7 +1,14 @@
 from __future__ import absolute_import
 
-import catalyze
+import os
 
-catalyze.init_cli()
+if "_CATALYZE_COMPLETE" in os.environ:
+    # keep TAB fast: the completer needs neither click nor the command modules
+    from catalyze import completion
+    completion.complete()
+else:
+    import catalyze
 
-catalyze.cli()
+    catalyze.init_cli()
+
+    catalyze.cli()
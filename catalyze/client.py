@@ -1,11 +1,14 @@
 from __future__ import absolute_import
 
-from catalyze import config, project, output
-import requests, json, getpass, os, sys, ssl
+from catalyze import config, project, output, pool, tls
+from catalyze.helpers import transfer
+import requests, json, getpass, os, sys, ssl, threading, time
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.poolmanager import PoolManager
 import requests.packages.urllib3.contrib.pyopenssl
 requests.packages.urllib3.contrib.pyopenssl.inject_into_urllib3()
+# set CATALYZE_TLS_STATS to print how many handshakes were made and how many of them were resumed
+tls.install(report = bool(os.getenv("CATALYZE_TLS_STATS")))
 
 class AuthError(Exception):
     def __init__(self, message):
@@ -14,6 +17,8 @@ class AuthError(Exception):
 class ClientError(Exception):
     def __init__(self, resp):
         message = resp
+        # the HTTP status of the failed response, or None if the error did not come from one
+        self.status_code = resp.status_code if type(resp) is requests.Response else None
         if type(resp) is requests.Response:
             try:
                 message = resp.json()
@@ -57,10 +62,27 @@ class ForcedTLSAdapter(HTTPAdapter):
             block = block,
             ssl_version = ssl.PROTOCOL_TLSv1)
 
+    resize_lock = threading.Lock()
+
+    def ensure_pool_size(self, maxsize):
+        """Grows the per-host connection pools to keep at least maxsize connections. Growing closes the old pools'
+        idle connections; connections in use are closed when they are released."""
+        with self.resize_lock:
+            if maxsize > self._pool_maxsize:
+                previous = self.poolmanager
+                self._pool_maxsize = maxsize
+                self.init_poolmanager(self._pool_connections, maxsize, self._pool_block)
+                previous.clear()
+
+# Every Session shares one adapter, and so one set of keep-alive connection pools (one per host), big enough that
+# concurrent requests from catalyze.pool do not open and discard extra connections.
+adapter = ForcedTLSAdapter(pool_maxsize = max(pool.default_workers, requests.adapters.DEFAULT_POOLSIZE))
+
 class Session:
     def __init__(self, token = None, user_id = None, username = None, password = None):
         self.session = requests.Session()
-        self.session.mount("https://", ForcedTLSAdapter())
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
         self.session.verify = "skip_cert_validation" not in config.behavior
         if token is None:
             self.sign_in(username, password)
@@ -73,6 +95,7 @@ class Session:
             "X-Api-Key": config.api_key,
             "Accept": "application/json",
             "Content-Type": "application/json",
+            "Accept-Encoding": "gzip, deflate",
             "Authorization": "Bearer " + self.token,
             "X-CLI-Version": config.version
         }
@@ -87,6 +110,63 @@ class Session:
         else:
             return resp
 
+    def map(self, calls, max_workers = pool.default_workers):
+        """
+        Sends independent API requests concurrently over the shared connection pools, which grow to match
+        max_workers.
+
+        :param calls: (method, url) or (method, url, body) tuples, where method is "get", "post", "put" or "delete"
+        :param max_workers: the maximum number of requests in flight at once
+        :return: a list of (body, error) tuples in the same order as calls. error is None on success, otherwise the
+            exception raised by that request, usually a ClientError
+        """
+        def send(call):
+            return getattr(self, call[0])(*call[1:], verify = True)
+        return self.map_calls(send, calls, max_workers = max_workers)
+
+    def map_calls(self, func, items, max_workers = pool.default_workers):
+        """
+        Like pool.map, but first grows the shared connection pools to max_workers, so that concurrent requests made
+        by func through this session reuse connections instead of opening and discarding extra ones.
+        """
+        adapter.ensure_pool_size(max_workers)
+        return pool.map(func, items, max_workers = max_workers)
+
+    def get_items(self, url, path = ()):
+        """
+        Streams the array found at path in the response, yielding each element as soon as it has arrived and been
+        decoded, so callers can act on the first items or stop early without downloading and parsing the whole
+        body. Stopping early closes the connection instead of returning it to the pool.
+
+        :param path: the keys leading from the top-level object to the array, or () if the body is the array
+        """
+        resp = self.session.get(url, headers = self._build_headers(), stream = True)
+        try:
+            if not is_ok(resp):
+                raise ClientError(resp)
+            for item in JSONStream(resp.iter_content(chunk_size = 16 * 1024)).items(path):
+                yield item
+        finally:
+            resp.close()
+
+    def get_if_changed(self, url, etag = None):
+        """
+        Conditional GET using If-None-Match.
+
+        :return: a (body, etag) tuple. body is None when the server answered 304 Not Modified, and etag is the one to
+            send next time (unchanged if the server does not return one)
+        """
+        headers = self._build_headers()
+        if etag is not None:
+            headers["If-None-Match"] = etag
+        resp = self.session.get(url, headers = headers)
+        if resp.status_code == 304:
+            return None, etag
+        elif is_ok(resp):
+            return (None if not resp.text else resp.json()), resp.headers.get("ETag", etag)
+        else:
+            raise ClientError(resp)
+
     def post(self, url, body, verify = False):
         resp = self.session.post(url, headers = self._build_headers(), data = json.dumps(body))
         if verify:
@@ -97,8 +177,32 @@ class Session:
         else:
             return resp
 
-    def put_file(self, url, file, verify = False):
-        resp = self.session.put(url, data = file)
+    def get_file(self, url):
+        """
+        Streams a file from a temporary object store URL. Read the body with iter_content. Raises ClientError if the
+        object store did not answer with success, before any of the body has been handed to the caller.
+        """
+        resp = self.session.get(url, stream = True)
+        if not is_ok(resp):
+            error = ClientError(resp)
+            resp.close()
+            raise error
+        return resp
+
+    def put_file(self, url, file, verify = False, meter = None):
+        """
+        Uploads the rest of a file to a temporary object store URL, rate limited and with progress, and prints a
+        throughput summary.
+
+        :param meter: the transfer.Transfer to count the upload with, for example one whose encryption time has been
+            set
+        """
+        if meter is None:
+            meter = transfer.Transfer("Uploaded", "encryption")
+        started = time.time()
+        resp = self.session.put(url, data = transfer.MeteredFile(file, meter))
+        meter.network_seconds = time.time() - started
+        meter.finish()
         if verify:
             if is_ok(resp):
                 return None if not resp.text else resp.json()
@@ -149,7 +253,127 @@ class Session:
     def __exit__(self, type, value, traceback):
         self.session.close()
 
+class JSONStream(object):
+    """
+    Decodes a JSON document piece by piece as its chunks arrive. Only the values on the way to the wanted array, and
+    one element of it at a time, are ever held in memory.
+    """
+    decoder = json.JSONDecoder()
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = ""
+        self.pos = 0
+        self.done = False
+
+    def read_more(self, minimum = 1):
+        """Appends chunks until at least minimum unread characters are buffered. Returns False if the document ended
+        before any more arrived."""
+        if self.done:
+            return False
+        pending = [self.buffer[self.pos:]]
+        size = len(pending[0])
+        while size < minimum or len(pending) == 1:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                self.done = True
+                break
+            pending.append(chunk)
+            size += len(chunk)
+        self.buffer = "".join(pending)
+        self.pos = 0
+        return len(pending) > 1
+
+    def peek(self):
+        """Skips whitespace and returns the next character, or None at the end of the document."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.read_more():
+                return None
+
+    def expect(self, chars):
+        char = self.peek()
+        if char is None or char not in chars:
+            raise ValueError("Expected one of '%s' at %r" % (chars, self.buffer[self.pos:self.pos + 20]))
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # a number cut off by the end of a chunk (such as "12." of "12.5") also decodes, so only trust a value
+                # that is followed by a delimiter
+                while end < len(self.buffer) and self.buffer[end] in " \t\r\n":
+                    end += 1
+                if (end < len(self.buffer) and self.buffer[end] in ",]}:") or not self.read_more():
+                    self.pos = end
+                    return value
+            except ValueError:
+                # a value longer than the buffer: at least double the buffer before decoding again, so a long value
+                # is decoded a logarithmic rather than linear number of times
+                if not self.read_more(2 * (len(self.buffer) - self.pos)):
+                    raise
+
+    def items(self, path = ()):
+        if len(path) > 0:
+            self.expect("{")
+            if self.peek() == "}":
+                return
+            while True:
+                key = self.value()
+                self.expect(":")
+                if key == path[0]:
+                    for item in self.items(path[1:]):
+                        yield item
+                    return
+                self.value()
+                if self.expect(",}") == "}":
+                    return
+        self.expect("[")
+        if self.peek() == "]":
+            return
+        while True:
+            yield self.value()
+            if self.expect(",]") == "]":
+                return
+
 def acquire_session(settings = None):
+    session = start_session(settings)
+    if settings is not None and settings.get("consoles"):
+        # imported here because catalyze.helpers.consoles imports this module
+        from catalyze.helpers import consoles
+        consoles.reap(session, settings)
+    return session
+
+def stdin_is_terminal():
+    try:
+        return sys.stdin.isatty()
+    except AttributeError:
+        return False
+
+def open_terminal():
+    """Opens /dev/tty for prompting when stdin is not a terminal (for example 'db import <db> -' reading a piped
+    dump), so that prompts never consume piped data. getpass does the same, but falls back to stdin."""
+    try:
+        return open("/dev/tty", "r+")
+    except (IOError, OSError):
+        output.error("Cannot prompt for credentials while stdin is not a terminal. Set CATALYZE_USERNAME and CATALYZE_PASSWORD, or sign in with another catalyze command first.")
+
+def prompt_username():
+    if stdin_is_terminal():
+        return raw_input("Username: ")
+    with open_terminal() as tty:
+        tty.write("Username: ")
+        tty.flush()
+        return tty.readline().rstrip("\n")
+
+def start_session(settings = None):
+    """Reuses the session saved in settings if it is still valid, and otherwise signs in and saves the new one."""
     if settings is not None and "token" in settings and "user_id" in settings:
         session = Session(token = settings["token"], user_id = settings["user_id"])
         resp = session.get(config.baas_host + "/v2/auth/verify")
@@ -159,9 +383,12 @@ def acquire_session(settings = None):
             output.write("Session has timed out. Please re-enter credentials.")
     username = os.getenv("CATALYZE_USERNAME") or config.username
     if username is None:
-        username = raw_input("Username: ") if "username" not in config.behavior else config.behavior["username"]
+        username = prompt_username() if "username" not in config.behavior else config.behavior["username"]
     password = os.getenv("CATALYZE_PASSWORD") or config.password
     if password is None:
+        if not stdin_is_terminal():
+            # fail here rather than let getpass fall back to reading the password from stdin
+            open_terminal().close()
         password = getpass.getpass("Password: ")
     session = Session(username = username, password = password)
     if settings is not None:
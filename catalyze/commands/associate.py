@@ -11,14 +11,14 @@ from catalyze.helpers import environments, services
 def associate(env_label, service_label, remote):
     """Associates the git repository in the current directory. This means that the service and environment IDs are stored locally, and a git remote is created (default name = "catalyze") so that code can be pushed, built, and deployed."""
     session = client.acquire_session()
-    for env in environments.list(session):
+    for env in environments.iterate(session):
         if env["data"]["name"] == env_label:
             settings = {
                     "token": session.token,
                     "user_id": session.user_id,
                     "environmentId": env["environmentId"]
                 }
-            code_services = [svc for svc in services.list(session, env["environmentId"]) if svc["type"] == "code"]
+            code_services = [svc for svc in services.iterate(session, env["environmentId"]) if svc["type"] == "code"]
             selected_service = None
             if len(code_services) == 0:
                 output.error("No code service found for \"%s\" environment (%s)" % (env_label, env["environmentId"]))
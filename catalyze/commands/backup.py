@@ -1,10 +1,10 @@
 from __future__ import absolute_import
 
-import click, json, requests, sys
-import tempfile, os, base64, binascii
+import click, json, sys
+import base64, binascii
 
-from catalyze import cli, client, project, output
-from catalyze.helpers import services, jobs, AESCrypto, tasks, logs
+from catalyze import cli, client, project, output, pool
+from catalyze.helpers import services, jobs, tasks, logs, transfer
 from datetime import datetime
 
 def parse_date(date):
@@ -31,7 +31,7 @@ def exec_list(service_label, page, page_size):
     backup_list.sort(lambda a, b: int((parse_date(a["created_at"]) - parse_date(b["created_at"])).total_seconds()))
     if len(backup_list) > 0:
         for item in backup_list:
-            output.write("%s %s (status = %s)" % (item["id"], item["created_at"], item["status"]))
+            output.record(item, "%s %s (status = %s)" % (item["id"], item["created_at"], item["status"]))
         if len(backup_list) == page_size and page == 1:
             output.write("(for older backups, try with --page=2 or adjust --page-size)")
     elif page == 1:
@@ -45,12 +45,12 @@ def create(service_label, skip_poll):
     session = client.acquire_session(settings)
     service_id = services.get_by_label(session, settings["environmentId"], service_label)
     task_id = services.create_backup(session, settings["environmentId"], service_id)
-    print("Backup started (task ID = %s)" % (task_id,))
+    output.write("Backup started (task ID = %s)" % (task_id,))
     if not skip_poll:
         output.write("Polling until backup finishes.")
         task = tasks.poll_status(session, settings["environmentId"], task_id, exit_on_error=False)
         output.write("\nEnded in status '%s'" % (task["status"],))
-        logs.dump(session, settings, service_label, service_id, task_id, "backup", None)
+        logs.dump(session, settings, service_label, service_id, task_id, "backup", None, job = task)
         if task["status"] != "finished":
             sys.exit(-1)
 
@@ -68,7 +68,7 @@ def restore(service_label, backup_id, skip_poll):
         output.write("Polling until restore is complete.")
         task = tasks.poll_status(session, settings["environmentId"], task_id, exit_on_error=False)
         output.write("\nEnded in status '%s'" % (task["status"],))
-        logs.dump(session, settings, service_label, service_id, task_id, "restore", None)
+        logs.dump(session, settings, service_label, service_id, task_id, "restore", None, job = task)
         if task["status"] != "finished":
             sys.exit(-1)
 
@@ -77,27 +77,25 @@ def restore(service_label, backup_id, skip_poll):
 @click.argument("backup_id")
 @click.argument("filepath", type=click.Path(exists=False))
 def download(service_label, backup_id, filepath):
+    """Downloads and decrypts a finished backup to a file, or streams it to stdout if the file is "-"."""
+    if filepath == "-":
+        output.reserve_stdout()
     settings = project.read_settings()
     session = client.acquire_session(settings)
     service_id = services.get_by_label(session, settings["environmentId"], service_label)
 
-    job = jobs.retrieve(session, settings["environmentId"], service_id, backup_id)
+    # the temporary URL is requested alongside the job rather than after it
+    (job, error), (url, url_error) = pool.map(lambda request: request(), [
+        lambda: jobs.retrieve(session, settings["environmentId"], service_id, backup_id),
+        lambda: services.get_temporary_url(session, settings["environmentId"], service_id, backup_id)
+    ])
+    if error is not None:
+        raise error
     if job["type"] != "backup" or job["status"] != "finished":
         output.error("Only 'finished' 'backup' jobs may be downloaded with this command")
+    if url_error is not None:
+        raise url_error
 
     output.write("Downloading backup %s" % (backup_id,))
-    url = services.get_temporary_url(session, settings["environmentId"], service_id, backup_id)
-    r = requests.get(url, stream=True)
-    basename = os.path.basename(filepath)
-    dir = tempfile.mkdtemp()
-    tmp_filepath = os.path.join(dir, basename)
-    with open(tmp_filepath, 'wb+') as f:
-        for chunk in r.iter_content(chunk_size=1024):
-            if chunk:
-                f.write(chunk)
-                f.flush()
-    output.write("Decrypting...")
-    decryption = AESCrypto.Decryption(tmp_filepath, job["backup"]["key"], job["backup"]["iv"])
-    decryption.decrypt(filepath)
-    os.remove(tmp_filepath)
-    output.write("%s downloaded successfully to %s" % (service_label, filepath))
+    transfer.download_decrypted(session, url, job["backup"]["key"], job["backup"]["iv"], filepath)
+    output.write("%s downloaded successfully to %s" % (service_label, filepath if filepath != "-" else "stdout"))
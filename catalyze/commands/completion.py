@@ -0,0 +1,14 @@
+from __future__ import absolute_import
+
+import click
+from catalyze import cli, completion, output
+
+@cli.command("completion", short_help = "Print the shell completion script")
+@click.argument("shell", type = click.Choice(["bash", "zsh"]), default = "bash")
+def completion_script(shell):
+    """Prints a script that enables TAB completion of commands, options, and environment and service labels. Load it from your shell's startup file, for example:
+
+    eval "$(catalyze completion bash)"
+
+Completion never contacts the API. Labels come from a snapshot in ~/.catalyze-completion.json that every command updates with the environments and services it has already fetched; run 'catalyze environments' or 'catalyze status' once to fill it."""
+    output.write(completion.BASH_SCRIPT if shell == "bash" else completion.ZSH_SCRIPT, sameline = True)
@@ -1,23 +1,29 @@
 from __future__ import absolute_import
 
-import json, click, sys, tty, termios, ssl
+import json, click, sys, os, tty, termios, socket, ssl, threading, time
 from select import select
 from ws4py.client.threadedclient import WebSocketClient
-from catalyze import cli, client, project, output, config
-from catalyze.helpers import services
+from catalyze import cli, client, project, output, config, pool
+from catalyze.helpers import services, consoles, recording
 
 console_closed = False
 
 @cli.command("console", short_help = "Open a secure console to a service")
 @click.argument("service_label")
 @click.argument("command", required = False, default = None)
-def open_console(service_label, command):
+@click.option("--keep-alive", type = int, default = 0, help = "Keep the console job running for this many seconds after disconnecting, so the next console to the same service and command reattaches immediately.")
+@click.option("--record", "record_path", type = click.Path(dir_okay = False), default = None, help = "Record the session's input and output to this file. Play it back with 'catalyze console-replay'.")
+def open_console(service_label, command, keep_alive, record_path):
     """
 Opens a secure console to a code or database service.
 
 For code services, a command is required. This command is executed as root in the context of the application root directory.
 
 For database services, no command is needed - instead, the appropriate command for the database type is run. For example, for a postgres database, psql is run.
+
+With --keep-alive, the console job is left running after you disconnect and its ID and token are recorded in the local settings. Later consoles to the same service and command reattach to it, with or without --keep-alive, until it has been idle for the given number of seconds. A console opened without --keep-alive destroys the job when you disconnect, even if it reattached to a kept-alive one.
+
+Expired console jobs are destroyed by the next catalyze command run from this repo that signs in.
 """
     global console_closed
     settings = project.read_settings()
@@ -25,63 +31,319 @@ For database services, no command is needed - instead, the appropriate command f
 
     service_id = services.get_by_label(session, settings["environmentId"], service_label)
 
-    output.write("Opening console to service '%s'" % (service_id))
+    job_id, creds = consoles.reuse(session, settings, service_id, command)
+    if job_id is None:
+        output.write("Opening console to service '%s'" % (service_id))
 
-    task_id = services.request_console(session, settings["environmentId"], service_id, command)["taskId"]
+        task_id = services.request_console(session, settings["environmentId"], service_id, command)["taskId"]
 
-    output.write("Waiting for the console to be ready... This might take a bit.")
+        output.write("Waiting for the console to be ready... This might take a bit.")
 
-    job_id = services.poll_console_job(session, settings["environmentId"], service_id, task_id)
-    creds = services.get_console_tokens(session, settings["environmentId"], service_id, job_id)
+        job_id = services.poll_console_job(session, settings["environmentId"], service_id, task_id)
+        creds = services.get_console_tokens(session, settings["environmentId"], service_id, job_id)
+    else:
+        output.write("Reattaching to console job %s" % (job_id,))
 
+    connected = False
+    recorder = recording.Recorder(record_path) if record_path is not None else None
     try:
         url = creds["url"].replace("http", "ws")
         token = creds["token"]
         output.write("Connecting...")
 
-        sslopt = {
-            "ssl_version": ssl.PROTOCOL_TLSv1
-        }
-        if "skip_cert_validation" in config.behavior:
-            sslopt["check_hostname"] = False
-        ws = ConsoleClient(url, ssl_options = sslopt, headers = [("X-Console-Token", token)])
+        ws = ConsoleClient(url, ssl_options = ssl_options(), headers = [("X-Console-Token", token)])
+        ws.recorder = recorder
         ws.daemon = False
         ws.connect()
+        connected = True
 
         with ContextedConsole() as c:
             while not console_closed:
-                data = c.get_data()
+                data = c.get_data(ws.wakeup_fd)
                 if data:
+                    if recorder is not None:
+                        recorder.record("i", data)
                     ws.send(data)
+        ws.output.close()
+    finally:
+        if recorder is not None:
+            recorder.close()
+            output.write("Session recorded to %s" % (record_path,))
+        if keep_alive > 0 and connected and consoles.remember(session, settings, service_id, command, job_id, creds, keep_alive):
+            output.write("Console job %s kept alive for %d seconds" % (job_id, keep_alive))
+        else:
+            output.write("Cleaning up")
+            services.destroy_console(session, settings["environmentId"], service_id, job_id)
+            consoles.forget(settings, service_id, command, job_id)
+
+@cli.command("console-replay", short_help = "Play back a recorded console session")
+@click.argument("filepath", type = click.Path(exists = True, dir_okay = False))
+@click.option("--start", type = float, default = 0.0, help = "Start playback this many seconds into the recording.")
+@click.option("--speed", type = float, default = 1.0, help = "Playback speed multiplier.")
+@click.option("--no-wait", is_flag = True, default = False, help = "Print all output immediately instead of in real time.")
+@click.option("--show-input", is_flag = True, default = False, help = "Also print the recorded input frames, marked with '>>> '.")
+def replay_console(filepath, start, speed, no_wait, show_input):
+    """Plays back a session recorded with 'catalyze console --record'. Playback can start at any point in the recording without reading what comes before it."""
+    previous = start
+    for ts, kind, data in recording.read_frames(filepath, start):
+        if not no_wait and ts > previous:
+            time.sleep((ts - previous) / speed)
+        previous = ts
+        if kind == "o":
+            sys.stdout.write(data)
+        elif show_input:
+            sys.stdout.write(">>> " + data + "\n")
+        sys.stdout.flush()
+
+@cli.command("console-exec", short_help = "Run a command on several services at once")
+@click.argument("command")
+@click.option("--service", "service_labels", multiple = True, help = "The label of a service to run the command on. May be repeated.")
+@click.option("--type", "service_type", default = None, help = "Run the command on every service of this type (for example 'code').")
+@click.option("--output-dir", type = click.Path(file_okay = False), default = None, help = "Write each service's output to <label>.log in this directory instead of the console.")
+@click.option("--workers", type = int, default = pool.default_workers, help = "How many consoles to run at once.")
+@click.option("--timeout", type = int, default = 3600, help = "How many seconds each console may take, from being requested until its command finishes, before it is closed and the service is counted as failed.")
+def exec_console(command, service_labels, service_type, output_dir, workers, timeout):
+    """
+Runs a command non-interactively in a console on several services concurrently.
+
+Every console is requested, waited on and connected to in parallel, so the whole batch takes about as long as a single console startup. Output is printed with a "<label> | " prefix on each line, or written to one file per service with --output-dir. Every console is destroyed once its command finishes or --timeout runs out.
+"""
+    if not service_labels and service_type is None:
+        output.error("At least one --service or a --type is required.")
+    settings = project.read_settings()
+    session = client.acquire_session(settings)
+    env_id = settings["environmentId"]
+
+    all_services = services.list(session, env_id)
+    labels = [svc["label"] for svc in all_services]
+    for label in service_labels:
+        if label not in labels:
+            output.error("Could not find service with label '%s'" % (label,))
+    selected = [svc for svc in all_services if svc["label"] in service_labels or svc["type"] == service_type]
+    if len(selected) == 0:
+        output.error("No services of type '%s' found." % (service_type,))
+    if output_dir is not None and not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    lock = threading.Lock()
+    def run(service):
+        if output_dir is None:
+            sink = PrefixedSink(service["label"] + " | ", sys.stdout, lock)
+        else:
+            sink = open(os.path.join(output_dir, service["label"] + ".log"), "w")
+        try:
+            return run_batch_console(session, env_id, service, command, sink, timeout)
+        finally:
+            sink.close()
+
+    output.write("Running '%s' on %s" % (command, ", ".join([svc["label"] for svc in selected])))
+    started = time.time()
+    results = session.map_calls(run, selected, max_workers = workers)
+    failed = 0
+    for service, (result, error) in zip(selected, results):
+        if error is None:
+            output.record({"service": service["label"], "status": "finished", "reason": result}, "%s: finished (%s)" % (service["label"], result))
+        else:
+            failed += 1
+            output.record({"service": service["label"], "status": "failed", "error": str(error)},
+                    "%s: failed (%s)" % (service["label"], error if not isinstance(error, SystemExit) else "see above"))
+    output.write("%d of %d consoles succeeded in %.1fs" % (len(selected) - failed, len(selected), time.time() - started))
+    if failed > 0:
+        sys.exit(-1)
+
+class ConsoleTimeout(Exception):
+    pass
+
+def run_batch_console(session, env_id, service, command, sink, timeout = None):
+    """Runs command in a console on a single service, writing all output to sink, and always destroys the console.
+    Returns the close reason reported by the server, or raises ConsoleTimeout if the console has not started,
+    connected and finished within timeout seconds of being requested."""
+    deadline = time.time() + timeout if timeout else None
+    def remaining():
+        return max(deadline - time.time(), 0) if deadline is not None else None
+
+    task_id = services.request_console(session, env_id, service["id"], command)["taskId"]
+    job_id = services.poll_console_job(session, env_id, service["id"], task_id, progress = False, timeout = remaining())
+    if job_id is None:
+        raise ConsoleTimeout("no console job after %ds" % (timeout,))
+    try:
+        creds = services.get_console_tokens(session, env_id, service["id"], job_id)
+        ws = BatchConsoleClient(sink, creds["url"].replace("http", "ws"), ssl_options = ssl_options(), headers = [("X-Console-Token", creds["token"])])
+        ws.daemon = True
+        # bound the connect and handshake, then go back to blocking reads for the client's own thread
+        ws.sock.settimeout(max(remaining(), 0.001) if deadline is not None else None)
+        try:
+            ws.connect()
+        except socket.timeout:
+            ws.close_connection()
+            raise ConsoleTimeout("could not connect within %ds" % (timeout,))
+        ws.sock.settimeout(None)
+        while not ws.done.is_set():
+            if deadline is not None and time.time() >= deadline:
+                ws.close(reason = "timed out")
+                raise ConsoleTimeout("timed out after %ds" % (timeout,))
+            ws.done.wait(0.5)
+        return ws.reason
     finally:
-        output.write("Cleaning up")
-        services.destroy_console(session, settings["environmentId"], service_id, job_id)
+        services.destroy_console(session, env_id, service["id"], job_id)
+
+def ssl_options():
+    sslopt = {
+        "ssl_version": ssl.PROTOCOL_TLSv1
+    }
+    if "skip_cert_validation" in config.behavior:
+        sslopt["check_hostname"] = False
+    return sslopt
 
 def emulate_console(ws):
     output.write("I am a test")
 
 class ConsoleClient(WebSocketClient):
+    def __init__(self, *args, **kwargs):
+        WebSocketClient.__init__(self, *args, **kwargs)
+        self.output = IdleFlushWriter(sys.stdout)
+        self.recorder = None
+        # written to when the socket closes so that the input loop can block on stdin without a timeout
+        self.wakeup_fd, self._wakeup_write_fd = os.pipe()
+
     def opened(self):
         output.write("Connection opened")
 
     def closed(self, code, reason):
         global console_closed
+        self.output.flush()
         output.write("Connection closed: %s (%s))" % (reason, str(code)))
         console_closed = True
+        os.write(self._wakeup_write_fd, b"x")
 
     def received_message(self, message):
-        output.write(message, sameline = True)
+        if self.recorder is not None:
+            self.recorder.record("o", str(message))
+        self.output.write(str(message))
+
+class BatchConsoleClient(WebSocketClient):
+    def __init__(self, sink, *args, **kwargs):
+        WebSocketClient.__init__(self, *args, **kwargs)
+        self.sink = sink
+        self.reason = None
+        self.done = threading.Event()
+
+    def closed(self, code, reason):
+        self.reason = "%s (%s)" % (reason, str(code))
+        self.done.set()
+
+    def received_message(self, message):
+        self.sink.write(str(message))
+
+class PrefixedSink:
+    """Writes whole lines to a shared stream with a prefix, holding back partial lines until they are completed."""
+    def __init__(self, prefix, stream, lock):
+        self.prefix = prefix
+        self.stream = stream
+        self.lock = lock
+        self.partial = ""
+
+    def write(self, data):
+        lines = (self.partial + data).split("\n")
+        self.partial = lines.pop()
+        if lines:
+            with self.lock:
+                self.stream.write("".join([self.prefix + line + "\n" for line in lines]))
+                self.stream.flush()
+
+    def close(self):
+        if self.partial:
+            self.write("\n")
+
+class IdleFlushWriter:
+    """
+    Buffers console output and flushes it once no new output has arrived for `idle` seconds, or as soon as
+    `max_buffered` bytes are pending. A burst of small websocket frames is written with a single flush.
+    """
+    def __init__(self, stream, idle = 0.005, max_buffered = 64 * 1024):
+        self.stream = stream
+        self.idle = idle
+        self.max_buffered = max_buffered
+        self._chunks = []
+        self._size = 0
+        self._last_write = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target = self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, data):
+        with self._condition:
+            self._chunks.append(data)
+            self._size += len(data)
+            self._last_write = time.time()
+            if self._size >= self.max_buffered:
+                self._flush_locked()
+            else:
+                self._condition.notify()
+
+    def flush(self):
+        with self._condition:
+            self._flush_locked()
+
+    def close(self):
+        with self._condition:
+            self._flush_locked()
+            self._closed = True
+            self._condition.notify()
+
+    def _flush_locked(self):
+        if self._chunks:
+            self.stream.write("".join(self._chunks))
+            self._chunks = []
+            self._size = 0
+        self.stream.flush()
+
+    def _run(self):
+        with self._condition:
+            while not self._closed:
+                if not self._chunks:
+                    self._condition.wait()
+                    continue
+                remaining = self._last_write + self.idle - time.time()
+                if remaining > 0:
+                    self._condition.wait(remaining)
+                else:
+                    self._flush_locked()
 
 class ContextedConsole:
+    # the most input sent in a single frame
+    max_frame = 64 * 1024
+
     def __enter__(self):
         self._settings = termios.tcgetattr(sys.stdin)
         tty.setcbreak(sys.stdin.fileno())
+        self._eof = False
         return self
 
     def __exit__(self, type, value, traceback):
         termios.tcsetattr(sys.stdin, termios.TCSADRAIN, self._settings)
 
-    def get_data(self):
-        if sys.stdin in select([sys.stdin], [], [], 1)[0]:
-            return sys.stdin.read(1)
-        return False
+    def get_data(self, wakeup_fd):
+        """
+        Blocks until input is available on stdin or wakeup_fd becomes readable, then drains every byte already
+        available on stdin (up to max_frame) so that a paste is sent as one frame rather than one frame per byte.
+        Returns False if there is no input.
+        """
+        fd = sys.stdin.fileno()
+        readable = select([fd, wakeup_fd] if not self._eof else [wakeup_fd], [], [])[0]
+        if fd not in readable:
+            return False
+        chunks = []
+        size = 0
+        while size < self.max_frame:
+            chunk = os.read(fd, self.max_frame - size)
+            if not chunk:
+                self._eof = True
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+            if fd not in select([fd], [], [], 0)[0]:
+                break
+        return "".join(chunks) or False
@@ -1,12 +1,9 @@
 from __future__ import absolute_import
 
 import click
-from catalyze import cli, client, project, output
-from catalyze.helpers import AESCrypto, environments, services, tasks, pods, logs
+from catalyze import cli, client, project, output, pool
+from catalyze.helpers import AESCrypto, environments, services, tasks, pods, logs, transfer
 import os, os.path, sys
-import requests
-from Crypto import Random
-from Crypto.Cipher import AES
 import tempfile, shutil, base64, binascii, struct
 
 @cli.group("db", short_help = "Interact with database services")
@@ -15,7 +12,7 @@ def db():
 
 @db.command("import", short_help = "Imports data into a database")
 @click.argument("database_label")
-@click.argument("filepath", type=click.Path(exists = True))
+@click.argument("filepath", type=click.Path(dir_okay = False))
 @click.option("--mongo-collection", default = None, help = "The name of a specific mongo collection to import into. Only applies for mongo imports.")
 @click.option("--mongo-database", default = None, help = "The name of the mongo database to import into, if not using the default. Only applies for mongo imports.")
 @click.option("--wipe-first", is_flag = True, default = False, help = "If set, empties the database before importing. This should not be used lightly.")
@@ -26,8 +23,12 @@ The import is accomplished by encrypting the file and uploading it to Catalyze.
 
 The type of file depends on the database. For postgres and mysql, this should be a single SQL script with the extension "sql". For mongo, this should be a tar'd, gzipped archive of the dump that you wish to import, with the extension "tar.gz".
 
+Pass "-" as the file to read the data from stdin, for example "pg_dump mydb | catalyze db import db01 -". The data is encrypted as it arrives, so it never has to be written to disk unencrypted.
+
 If there is an unexpected error, please contact Catalyze support (support@catalyze.io).
 """
+    if filepath != "-" and not os.path.isfile(filepath):
+        output.error("File '%s' does not exist." % (filepath,))
     settings = project.read_settings()
     session = client.acquire_session(settings)
     output.write("Looking up service...")
@@ -37,25 +38,30 @@ If there is an unexpected error, please contact Catalyze support (support@cataly
     pod = pods.metadata(session, environment["podId"])
     padding_required = pod["importRequiresLength"]
 
-    output.write("Importing '%s' to %s (%s)" % (filepath, database_label, service_id))
-    basename = os.path.basename(filepath)
+    output.write("Importing '%s' to %s (%s)" % (filepath if filepath != "-" else "stdin", database_label, service_id))
+    basename = os.path.basename(filepath) if filepath != "-" else "stdin"
     dir = tempfile.mkdtemp()
-    key = Random.new().read(32)
-    iv = Random.new().read(AES.block_size)
+    key = os.urandom(32)
+    iv = os.urandom(AESCrypto.BLOCK_SIZE)
     output.write("Encrypting...")
+    upload = transfer.Transfer("Uploaded", "encryption")
     try:
         enc_filepath = os.path.join(dir, basename)
-        with open(filepath, 'rb') as file:
+        with (open(filepath, 'rb') if filepath != "-" else os.fdopen(os.dup(sys.stdin.fileno()), 'rb')) as file:
             with open(enc_filepath, 'wb') as tf:
                 if padding_required:
-                    filesize = os.path.getsize(filepath)
+                    # the size isn't known until the input has been read (it may be a pipe), so reserve the
+                    # header and fill it in afterwards
+                    tf.write(struct.pack("<Q", 0))
+
+                encryption = AESCrypto.Encryption(key, iv)
+                filesize = encryption.encrypt(file, tf)
+                upload.crypto_seconds = encryption.seconds
+
+                if padding_required:
                     output.write("File size = %d" % (filesize,))
+                    tf.seek(0)
                     tf.write(struct.pack("<Q", filesize))
-                
-                contents = file.read()
-                contents += b'\0' * (AES.block_size - len(contents) % AES.block_size)
-                cipher = AES.new(key, mode = AES.MODE_CBC, IV = iv)
-                tf.write(cipher.encrypt(contents))
 
         with open(enc_filepath, 'rb') as file:
             options = {}
@@ -74,13 +80,13 @@ If there is an unexpected error, please contact Catalyze support (support@cataly
                     service_id, upload_url, file,
                     base64.b64encode(binascii.hexlify(key)),
                     base64.b64encode(binascii.hexlify(iv)),
-                    wipe_first, options)
+                    wipe_first, options, meter = upload)
 
             task_id = resp["id"]
             output.write("Processing import... (id = %s)" % (task_id,))
             job = tasks.poll_status(session, settings["environmentId"], task_id, exit_on_error=False)
             output.write("\nImport complete (end status = '%s')" % (job["status"],))
-            logs.dump(session, settings, database_label, service_id, task_id, "restore", None)
+            logs.dump(session, settings, database_label, service_id, task_id, "restore", None, job = job)
             if job["status"] != "finished":
                 sys.exit(-1)
     finally:
@@ -92,37 +98,46 @@ If there is an unexpected error, please contact Catalyze support (support@cataly
 def cmd_export(database_label, filepath):
     """Exports all data from a chosen database service.
 
-The export command is accomplished by first creating a backup of the database. Then requesting a temporary access URL to the encrypted backup file. The file is downloaded, decrypted, and stored at the provided location.
+The export command is accomplished by first creating a backup of the database. Then requesting a temporary access URL to the encrypted backup file. The file is downloaded, decrypted, and stored at the provided location. The backup's logs are fetched at the same time and printed once the download finishes.
+
+Pass "-" as the location to stream the decrypted data to stdout instead, for example "catalyze db export db01 - | psql mydb". All other messages are then printed to stderr.
 
 If there is an unexpected error, please contact Catalyze support (support@catalyze.io).
 """
+    if filepath == "-":
+        output.reserve_stdout()
     settings = project.read_settings()
     session = client.acquire_session(settings)
     service_id = services.get_by_label(session, settings["environmentId"], database_label)
     task_id = services.create_backup(session, settings["environmentId"], service_id)
-    print("Export started (task ID = %s)" % (task_id,))
+    output.write("Export started (task ID = %s)" % (task_id,))
     output.write("Polling until export finishes.")
     job = tasks.poll_status(session, settings["environmentId"], task_id, exit_on_error=False)
     if job["status"] != "finished":
         output.write("\nExport finished with illegal status \"%s\", aborting." % (job["status"],))
-        logs.dump(session, settings, database_label, service_id, task_id, "backup", None)
+        logs.dump(session, settings, database_label, service_id, task_id, "backup", None, job = job)
         sys.exit(-1)
     output.write("\nEnded in status '%s'" % (job["status"],))
     backup_id = job["id"]
     output.write("Downloading...")
-    url = services.get_temporary_url(session, settings["environmentId"], service_id, backup_id)
-    r = requests.get(url, stream=True)
-    basename = os.path.basename(filepath)
-    dir = tempfile.mkdtemp()
-    tmp_filepath = os.path.join(dir, basename)
-    with open(tmp_filepath, 'wb+') as f:
-        for chunk in r.iter_content(chunk_size=1024):
-            if chunk:
-                f.write(chunk)
-                f.flush()
-    output.write("Decrypting...")
-    decryption = AESCrypto.Decryption(tmp_filepath, job["backup"]["key"], job["backup"]["iv"])
-    decryption.decrypt(filepath)
-    os.remove(tmp_filepath)
-    output.write("%s exported successfully to %s" % (database_label, filepath))
-    logs.dump(session, settings, database_label, service_id, task_id, "backup", None)
+    # the backup and its logs are independent, so both URLs are requested as soon as the task is done and both
+    # files are downloaded and decrypted at once
+    urls = pool.map(lambda get_url: get_url(), [
+        lambda: services.get_temporary_url(session, settings["environmentId"], service_id, backup_id),
+        lambda: services.get_temporary_logs_url(session, settings["environmentId"], service_id, "backup", backup_id)
+    ])
+    for url, error in urls:
+        if error is not None:
+            raise error
+    backup_url, logs_url = [url for url, error in urls]
+    (result, error), (log_data, logs_error) = pool.map(lambda stage: stage(), [
+        lambda: transfer.download_decrypted(session, backup_url, job["backup"]["key"], job["backup"]["iv"], filepath),
+        lambda: logs.fetch(session, settings["environmentId"], service_id, "backup", job, url = logs_url)
+    ])
+    if error is not None:
+        raise error
+    output.write("%s exported successfully to %s" % (database_label, filepath if filepath != "-" else "stdout"))
+    output.write("Retrieving %s logs for task %s ..." % (database_label, task_id))
+    if logs_error is not None:
+        raise logs_error
+    logs.show(database_label, task_id, log_data, None)
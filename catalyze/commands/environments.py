@@ -8,8 +8,10 @@ def list_environments():
     """Lists all environments to which you have access."""
     settings = project.read_settings(required = False)
     session = client.acquire_session(settings)
-    envs = environments.list(session)
-    for env in envs:
-        output.write("%s: %s (state: %s)" % (env["data"]["name"], env["environmentId"], env["state"]))
-    if len(envs) == 0:
+    found = False
+    for env in environments.iterate(session):
+        found = True
+        output.record({"name": env["data"]["name"], "id": env["environmentId"], "state": env["state"]},
+                "%s: %s (state: %s)" % (env["data"]["name"], env["environmentId"], env["state"]))
+    if not found:
         output.write("no environments found")
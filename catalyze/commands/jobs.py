@@ -0,0 +1,109 @@
+from __future__ import absolute_import
+
+import click, json
+from datetime import datetime
+from catalyze import cli, client, project, output, pool
+from catalyze.helpers import services, jobs, job_history
+
+@cli.group("jobs", short_help = "Search the job history of your services")
+def jobs_group():
+    """Keeps a local index of the job history (builds, deploys, backups, restores, ...) of every service in the associated environment, so it can be searched without downloading it again. Run 'catalyze jobs sync' to bring the index up to date."""
+
+@jobs_group.command(short_help = "Update the local job index")
+@click.argument("service_labels", nargs = -1)
+@click.option("--workers", type = int, default = pool.default_workers, help = "How many services to sync at once.")
+def sync(service_labels, workers):
+    """Fetches the job history of every service in the environment, or of the given services, into the local index. A history that has not changed since the last sync is not downloaded again."""
+    settings = project.read_settings()
+    session = client.acquire_session(settings)
+    history = job_history.JobHistory()
+    try:
+        sync_services(session, history, settings["environmentId"], service_labels, workers)
+    finally:
+        history.close()
+
+def sync_services(session, history, env_id, service_labels = (), workers = pool.default_workers):
+    svcs = services.list(session, env_id)
+    labels = [svc["label"] for svc in svcs]
+    for label in service_labels:
+        if label not in labels:
+            output.error("Could not find service with label '%s'. Labels found: %s" % (label, ", ".join(labels)))
+    if len(service_labels) > 0:
+        svcs = [svc for svc in svcs if svc["label"] in service_labels]
+    etags = dict([(svc["id"], history.etag(env_id, svc["id"])) for svc in svcs])
+    results = session.map_calls(lambda svc: jobs.list_if_changed(session, env_id, svc["id"], etags[svc["id"]]), svcs, max_workers = workers)
+    for svc, (result, error) in zip(svcs, results):
+        if error is not None:
+            output.record({"service": svc["label"], "error": str(error)},
+                    "%s: could not be synced (%s)" % (svc["label"], error if not isinstance(error, SystemExit) else "see above"))
+            continue
+        service_jobs, etag = result
+        changed = history.update(env_id, svc["id"], svc["label"], service_jobs, etag)
+        output.record({"service": svc["label"], "changed": changed},
+                "%s: %s" % (svc["label"], "%d new or updated jobs" % (changed,) if service_jobs is not None else "unchanged"))
+
+def parse_time(value):
+    for format in ["%Y-%m-%d", "%Y-%m-%dT%H:%M:%S"]:
+        try:
+            return datetime.strptime(value, format).strftime("%Y-%m-%dT%H:%M:%S")
+        except ValueError:
+            pass
+    raise click.BadParameter("expected YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS, got '%s'" % (value,))
+
+@jobs_group.command("list", short_help = "Search the local job index")
+@click.option("--service", "service_label", default = None, help = "Only jobs of this service.")
+@click.option("--type", "job_type", default = None, help = "Only jobs of this type (build, deploy, backup, restore, ...).")
+@click.option("--status", default = None, help = "Only jobs in this status (finished, failed, ...).")
+@click.option("--since", default = None, help = "Only jobs created on or after this date (YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS).")
+@click.option("--until", default = None, help = "Only jobs created before this date (YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS).")
+@click.option("--limit", type = int, default = 50, help = "The most jobs to show, newest first. 0 for no limit.")
+@click.option("--sync", "sync_first", is_flag = True, default = False, help = "Sync the index before searching.")
+def list_jobs(service_label, job_type, status, since, until, limit, sync_first):
+    """Lists jobs from the local index, newest first, for example "catalyze jobs list --type restore --status failed --since 2015-06-01". Searches are answered locally; pass --sync or run 'catalyze jobs sync' first to pick up new jobs."""
+    since = parse_time(since) if since is not None else None
+    until = parse_time(until) if until is not None else None
+    settings = project.read_settings()
+    history = job_history.JobHistory()
+    try:
+        if sync_first:
+            sync_services(client.acquire_session(settings), history, settings["environmentId"])
+        if len(history.last_synced(settings["environmentId"])) == 0:
+            output.error("No job history has been synced yet. Run 'catalyze jobs sync' first.")
+        found = history.query(settings["environmentId"], service_label, job_type, status, since, until, limit or None)
+    finally:
+        history.close()
+    for job in found:
+        output.record(job, "%s %s %-8s %-8s (status = %s)" % (job["created_at"], job["id"], job["service"], job["type"], job["status"]))
+    if len(found) == 0:
+        output.write("No matching jobs.")
+    elif len(found) == limit:
+        output.write("(showing the newest %d, raise --limit to see more)" % (limit,))
+
+@jobs_group.command(short_help = "Show the details of jobs")
+@click.argument("job_ids", nargs = -1, required = True)
+def show(job_ids):
+    """Prints the full details of jobs in the local index. Details are fetched once and cached, except for jobs that are still running."""
+    settings = project.read_settings()
+    env_id = settings["environmentId"]
+    history = job_history.JobHistory()
+    try:
+        entries = [history.get(env_id, job_id) for job_id in job_ids]
+        for job_id, entry in zip(job_ids, entries):
+            if entry is None:
+                output.error("Job %s is not in the local index. Run 'catalyze jobs sync' first." % (job_id,))
+        missing = [(job_id, entry[0]) for job_id, entry in zip(job_ids, entries) if not entry[2]]
+        details = {}
+        if len(missing) > 0:
+            session = client.acquire_session(settings)
+            for service_id in set([service_id for job_id, service_id in missing]):
+                ids = [job_id for job_id, job_service_id in missing if job_service_id == service_id]
+                for job_id, (job, error) in zip(ids, jobs.retrieve_many(session, env_id, service_id, ids)):
+                    if error is not None:
+                        raise error
+                    history.save_detail(env_id, job_id, job)
+                    details[job_id] = job_history.redact(job)
+    finally:
+        history.close()
+    for job_id, entry in zip(job_ids, entries):
+        job = details.get(job_id, entry[1])
+        output.record(job, json.dumps(job, indent = 4, sort_keys = True))
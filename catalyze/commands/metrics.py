@@ -6,21 +6,45 @@ import json
 import time
 import math
 import csv
+import array
+import threading
 from StringIO import StringIO
-from catalyze import cli, client, project, output
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from catalyze import cli, client, project, output, pool
 from catalyze.helpers import environments, services
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 @cli.command("metrics", short_help = "Get service metrics")
 @click.argument("service_label", required = False, default = None)
 @click.option("--format", help = "Output in a special format. Accepted values are 'csv' and 'json'.")
 @click.option("--stream", is_flag = True, default = False, help = "Repeat calls once per minute until this process is interrupted.")
 @click.option("--mins", type = int, default = 1, help = "How many minutes' worth of logs to retrieve.")
-def metrics(service_label, format, stream, mins):
-    """Print out metrics about a single service or all services in an environment."""
+@click.option("--summary", is_flag = True, default = False, help = "Print per-job and per-service aggregates instead of every sample.")
+@click.option("--env", "env_labels", multiple = True, help = "Collect metrics from this environment instead of the associated one. May be repeated.")
+@click.option("--all-envs", is_flag = True, default = False, help = "Collect metrics from every environment you have access to.")
+@click.option("--workers", type = int, default = pool.default_workers, help = "How many environments to query at once with --env or --all-envs.")
+def metrics(service_label, format, stream, mins, summary, env_labels, all_envs, workers):
+    """Print out metrics about a single service or all services in an environment.
+
+With --env or --all-envs, metrics for every service in each selected environment are fetched concurrently and printed together, tagged with the environment name."""
     if stream and (format or mins != 1):
         output.error("--stream cannot be used with a custom format or multiple records.")
+    if (env_labels or all_envs) and service_label is not None:
+        output.error("A service label cannot be used with --env or --all-envs.")
+
+    if output.json_mode and format is None:
+        format = "json"
 
-    if format is None:
+    if summary:
+        if format not in [None, "csv", "json"]:
+            output.error("unrecognized format '%s'" % (format,))
+        transformer = SummaryTransformer(format)
+    elif format is None:
         transformer = TextTransformer()
     elif format == "csv":
         transformer = CSVTransformer()
@@ -29,6 +53,15 @@ def metrics(service_label, format, stream, mins):
     else:
         output.error("unrecognized format '%s'" % (format,))
 
+    if env_labels or all_envs:
+        settings = project.read_settings(required = False)
+        session = client.acquire_session(settings)
+        envs = environments.select(session, env_labels, all_envs)
+        transformer.set_environment_mode()
+        transformer.set_retriever(lambda: retrieve_environment_metrics(session, envs, mins, workers))
+        transformer.process(stream)
+        return
+
     settings = project.read_settings()
     session = client.acquire_session(settings)
 
@@ -41,14 +74,70 @@ def metrics(service_label, format, stream, mins):
 
     transformer.process(stream)
 
+@cli.command("metrics-serve", short_help = "Serve metrics to Prometheus")
+@click.option("--host", default = "127.0.0.1", help = "The address to listen on.")
+@click.option("--port", type = int, default = 9337, help = "The port to listen on.")
+@click.option("--interval", type = int, default = 60, help = "How many seconds to wait between refreshes of the cached metrics.")
+@click.option("--env", "env_labels", multiple = True, help = "Export metrics from this environment instead of the associated one. May be repeated.")
+@click.option("--all-envs", is_flag = True, default = False, help = "Export metrics from every environment you have access to.")
+@click.option("--workers", type = int, default = pool.default_workers, help = "How many environments to query at once on each refresh.")
+def metrics_serve(host, port, interval, env_labels, all_envs, workers):
+    """Runs an HTTP server that exposes the latest metrics of every service at /metrics in the Prometheus text format.
+
+Metrics are fetched once per interval into an in-process cache, and every scrape is answered from that cache, so any number of scrapers costs a single upstream request per environment per interval. An environment whose refresh fails keeps its last fetched metrics, and catalyze_refresh_success reports whether each environment's latest refresh worked. The session is renewed when it times out."""
+    if env_labels or all_envs:
+        settings = project.read_settings(required = False)
+        session = client.acquire_session(settings)
+        envs = environments.select(session, env_labels, all_envs)
+    else:
+        settings = project.read_settings()
+        session = client.acquire_session(settings)
+        envs = [(env["data"]["name"], env["environmentId"]) for env in environments.list(session) if env["environmentId"] == settings["environmentId"]]
+        if len(envs) == 0:
+            output.error("The associated environment could not be found.")
+
+    source = EnvironmentMetricsSource(session, settings, envs, workers)
+    cache = MetricsCache(source.render, interval)
+    cache.refresh()
+    cache.start()
+    server = MetricsServer((host, port), MetricsRequestHandler)
+    server.cache = cache
+    output.write("Serving metrics for %s at http://%s:%d/metrics" % (", ".join([name for name, env_id in envs]), host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def retrieve_environment_metrics(session, envs, mins, workers):
+    """Fetches the metrics of every given environment concurrently and merges them into one group, tagging each
+    service with the name of its environment. Environments that fail are reported and skipped."""
+    merged = []
+    results = session.map_calls(lambda env: environments.retrieve_metrics(session, env[1], mins), envs, max_workers = workers)
+    for (name, env_id), (data, error) in zip(envs, results):
+        if error is not None:
+            if not isinstance(error, SystemExit):
+                output.error("%s: %s" % (name, error), exit = False)
+            continue
+        for service in data:
+            service["environmentName"] = name
+            merged.append(service)
+    return merged
+
 class MetricsTransformer:
     def __init__(self):
         self.group_mode = False
+        self.environment_mode = False
         self.retriever = lambda: {}
 
     def set_group_mode(self):
         self.group_mode = True
 
+    def set_environment_mode(self):
+        self.group_mode = True
+        self.environment_mode = True
+
     def set_retriever(self, func):
         self.retriever = func
 
@@ -83,15 +172,15 @@ class TextTransformer(MetricsTransformer):
 
     def transform_group(self, data):
         for service in data:
-            output.write(service["serviceName"] + ":")
+            output.write(service_name(service) + ":")
             self.transform_single(service["jobs"], prefix = "    ")
 
 class JSONTransformer(MetricsTransformer):
     def transform_single(self, data):
-        output.write(json.dumps(data))
+        output.record(data, json.dumps(data))
 
     def transform_group(self, data):
-        output.write(json.dumps(data))
+        output.record(data, json.dumps(data))
 
 class CSVTransformer(MetricsTransformer):
     def __init__(self):
@@ -104,10 +193,11 @@ class CSVTransformer(MetricsTransformer):
         if not self.headers_printed:
             base_headers = ["timestamp", "type", "job_id", "cpu_usage", "rx_kb", "tx_kb", "memory", "disk_read", "disk_write"]
             headers = base_headers if not self.group_mode else ["service_label", "service_id"] + base_headers
+            headers = headers if not self.environment_mode else ["environment"] + headers
             self.writer.writerow(headers)
             self.headers_printed = True
 
-    def transform_single(self, data, service_id = None, service_label = None):
+    def transform_single(self, data, service_id = None, service_label = None, environment = None):
         self.write_headers_maybe()
         for job in data:
             for metric in job["metrics"]:
@@ -115,15 +205,265 @@ class CSVTransformer(MetricsTransformer):
                         job["type"],
                         job["id"]] + metric_to_list(metric)
                 row = row if service_id is None else [service_label, service_id] + row
+                row = row if environment is None else [environment] + row
                 self.writer.writerow(row)
         if service_id is None:
-            output.write(self.sio.getvalue())
+            output.write(self.sio.getvalue(), stream = sys.stdout)
 
     def transform_group(self, data):
         self.write_headers_maybe()
         for service in data:
-            self.transform_single(service["jobs"], service["serviceId"], service["serviceName"])
-        output.write(self.sio.getvalue())
+            self.transform_single(service["jobs"], service["serviceId"], service["serviceName"], service.get("environmentName"))
+        output.write(self.sio.getvalue(), stream = sys.stdout)
+
+class SummaryTransformer(MetricsTransformer):
+    def __init__(self, format = None):
+        MetricsTransformer.__init__(self)
+        self.format = format
+
+    def transform_single(self, data):
+        self.write_summaries([({}, summarize(data))])
+
+    def transform_group(self, data):
+        self.write_summaries([(service, summarize(service["jobs"])) for service in data])
+
+    def write_summaries(self, summaries):
+        if self.format == "json":
+            records = []
+            for service, summary in summaries:
+                record = dict(summary, service_id = service.get("serviceId"), service_label = service.get("serviceName"))
+                if self.environment_mode:
+                    record["environment"] = service["environmentName"]
+                records.append(record)
+            output.record(records, json.dumps(records))
+        elif self.format == "csv":
+            sio = StringIO()
+            writer = csv.writer(sio)
+            headers = ["type", "job_id"] + list(SUMMARY_FIELDS)
+            prefix = []
+            if self.environment_mode:
+                prefix.append("environment")
+            if self.group_mode:
+                prefix += ["service_label", "service_id"]
+            writer.writerow(prefix + headers)
+            for service, summary in summaries:
+                prefix = []
+                if self.environment_mode:
+                    prefix.append(service["environmentName"])
+                if self.group_mode:
+                    prefix += [service["serviceName"], service["serviceId"]]
+                for row in summary["jobs"] + [summary["total"]]:
+                    writer.writerow(prefix + [row[field] for field in headers])
+            output.write(sio.getvalue(), stream = sys.stdout)
+        else:
+            for service, summary in summaries:
+                prefix = ""
+                if self.group_mode:
+                    output.write(service_name(service) + ":")
+                    prefix = "    "
+                for row in summary["jobs"] + [summary["total"]]:
+                    output.write("%s%8s (%s) | Samples: %d | CPU: avg %5.2f%% max %5.2f%% | Net: RX: %.2f KB TX: %.2f KB | Mem: peak %.2f KB | Disk: %.2f KB read / %.2f KB write" % \
+                            tuple([prefix] + [row[field] for field in ["type", "job_id"] + list(SUMMARY_FIELDS)]))
+
+PROMETHEUS_GAUGES = [
+    ("catalyze_cpu_seconds", "CPU time used during the sample minute."),
+    ("catalyze_cpu_percent", "CPU usage during the sample minute."),
+    ("catalyze_network_rx_kb", "Average network KB received."),
+    ("catalyze_network_tx_kb", "Average network KB transmitted."),
+    ("catalyze_memory_kb", "Average memory usage in KB."),
+    ("catalyze_disk_read_kb", "Disk KB read."),
+    ("catalyze_disk_write_kb", "Disk KB written.")
+]
+
+def render_prometheus(data):
+    """Renders the most recent sample of every job in a merged environment group as Prometheus gauges."""
+    samples = []
+    for service in data:
+        for job in service["jobs"]:
+            if len(job["metrics"]) > 0:
+                labels = "{environment=\"%s\",service=\"%s\",job_type=\"%s\",job_id=\"%s\"}" % tuple([prometheus_escape(value) \
+                        for value in [service["environmentName"], service["serviceName"], job["type"], job["id"]]])
+                latest = max(job["metrics"], key = lambda metric: metric["ts"])
+                samples.append((labels, metric_to_list(latest)))
+    lines = []
+    for index, (name, description) in enumerate(PROMETHEUS_GAUGES):
+        lines.append("# HELP %s %s" % (name, description))
+        lines.append("# TYPE %s gauge" % (name,))
+        for labels, values in samples:
+            lines.append("%s%s %s" % (name, labels, repr(float(values[index]))))
+    return "\n".join(lines) + "\n"
+
+def prometheus_escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+class EnvironmentMetricsSource:
+    """Fetches the latest metrics of several environments for metrics-serve. The last good data of each environment
+    is kept, so an environment that fails to refresh goes on being exported with its previous values rather than
+    dropping out of the page, and a timed out session is replaced by signing in again."""
+    def __init__(self, session, settings, envs, workers):
+        self.session = session
+        self.settings = settings
+        self.envs = envs
+        self.workers = workers
+        self.last = {}
+        self.succeeded = dict([(env_id, False) for name, env_id in envs])
+
+    def fetch(self, envs):
+        return self.session.map_calls(lambda env: environments.retrieve_metrics(self.session, env[1], 1), envs, max_workers = self.workers)
+
+    def refresh(self):
+        results = self.fetch(self.envs)
+        expired = [env for env, (data, error) in zip(self.envs, results) if isinstance(error, client.ClientError) and error.status_code == 401]
+        if len(expired) > 0:
+            output.write("Session has timed out, signing in again")
+            self.session = client.acquire_session(self.settings)
+            retried = dict(zip(expired, self.fetch(expired)))
+            results = [retried.get(env, result) for env, result in zip(self.envs, results)]
+        for (name, env_id), (data, error) in zip(self.envs, results):
+            self.succeeded[env_id] = error is None
+            if error is not None:
+                if not isinstance(error, SystemExit):
+                    output.error("%s: %s" % (name, error), exit = False)
+                continue
+            for service in data:
+                service["environmentName"] = name
+            self.last[env_id] = data
+
+    def render(self):
+        self.refresh()
+        merged = []
+        for name, env_id in self.envs:
+            merged.extend(self.last.get(env_id, []))
+        lines = ["# HELP catalyze_refresh_success Whether the latest refresh of the environment's metrics succeeded.",
+                 "# TYPE catalyze_refresh_success gauge"]
+        for name, env_id in self.envs:
+            lines.append("catalyze_refresh_success{environment=\"%s\"} %d" % (prometheus_escape(name), 1 if self.succeeded[env_id] else 0))
+        return render_prometheus(merged) + "\n".join(lines) + "\n"
+
+class MetricsCache:
+    """Holds the last rendered metrics page and refreshes it on a background thread once per interval. A refresh
+    that raises is reported and the previous page keeps being served."""
+    def __init__(self, renderer, interval):
+        self.renderer = renderer
+        self.interval = interval
+        self.body = ""
+        self.updated = 0
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        try:
+            body = self.renderer()
+        except BaseException as e:
+            if not isinstance(e, SystemExit):
+                output.error("Could not refresh metrics: %s" % (e,), exit = False)
+            return
+        with self.lock:
+            self.body = body
+            self.updated = time.time()
+
+    def start(self):
+        thread = threading.Thread(target = self.run)
+        thread.daemon = True
+        thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            self.refresh()
+
+    def get(self):
+        with self.lock:
+            return self.body, self.updated
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body, updated = self.server.cache.get()
+        body += "# HELP catalyze_last_refresh_timestamp_seconds When the cached metrics were last fetched.\n" + \
+                "# TYPE catalyze_last_refresh_timestamp_seconds gauge\n" + \
+                "catalyze_last_refresh_timestamp_seconds %s\n" % (repr(float(updated)),)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def service_name(service):
+    if "environmentName" in service:
+        return "%s/%s" % (service["environmentName"], service["serviceName"])
+    return service["serviceName"]
+
+SUMMARY_FIELDS = ("samples", "cpu_mean", "cpu_max", "rx_kb", "tx_kb", "memory_peak", "disk_read", "disk_write")
+
+def load_columns(jobs):
+    """Flattens the samples of every job into parallel columns of raw values.
+
+    Returns the columns (cpu nanoseconds, rx bytes, tx bytes, memory bytes, disk read bytes, disk write bytes) and the
+    index of the first sample of each job."""
+    columns = [array.array("d") for i in range(6)]
+    cpu, rx, tx, memory, disk_read, disk_write = columns
+    offsets = []
+    for job in jobs:
+        offsets.append(len(cpu))
+        for metric in job["metrics"]:
+            network = metric["network"]
+            cpu.append(metric["cpu"]["usage"])
+            rx.append(network["rx_bytes"]["ave"] if "rx_bytes" in network else network["rx_kb"] * 1024.0)
+            tx.append(network["tx_bytes"]["ave"] if "tx_bytes" in network else network["tx_kb"] * 1024.0)
+            memory.append(metric["memory"]["ave"])
+            disk_read.append(metric["diskio"]["read"])
+            disk_write.append(metric["diskio"]["write"])
+    return columns, offsets
+
+def summarize(jobs):
+    """Aggregates every sample of the given jobs into per-job rows and a total row, using the same units and rounding
+    as metric_to_list. Uses numpy when available and falls back to plain arrays otherwise."""
+    columns, offsets = load_columns(jobs)
+    bounds = zip(offsets, offsets[1:] + [len(columns[0])])
+    if numpy is not None:
+        cpu, rx, tx, memory, disk_read, disk_write = [numpy.frombuffer(column, dtype = numpy.float64) for column in columns]
+        cpu = cpu / 1000000000.0 / 60.0 * 100.0
+        rx, tx, memory, disk_read, disk_write = [numpy.ceil(column / 1024.0) for column in (rx, tx, memory, disk_read, disk_write)]
+        aggregate = lambda start, end: [
+                end - start,
+                float(cpu[start:end].mean()),
+                float(cpu[start:end].max()),
+                float(rx[start:end].sum()),
+                float(tx[start:end].sum()),
+                float(memory[start:end].max()),
+                float(disk_read[start:end].sum()),
+                float(disk_write[start:end].sum())]
+    else:
+        cpu = [value / 1000000000.0 / 60.0 * 100.0 for value in columns[0]]
+        rx, tx, memory, disk_read, disk_write = [[math.ceil(value / 1024.0) for value in column] for column in columns[1:]]
+        aggregate = lambda start, end: [
+                end - start,
+                sum(cpu[start:end]) / (end - start),
+                max(cpu[start:end]),
+                sum(rx[start:end]),
+                sum(tx[start:end]),
+                max(memory[start:end]),
+                sum(disk_read[start:end]),
+                sum(disk_write[start:end])]
+    empty = [0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+    rows = []
+    for job, (start, end) in zip(jobs, bounds):
+        row = dict(zip(SUMMARY_FIELDS, aggregate(start, end) if end > start else empty))
+        row["type"] = job["type"]
+        row["job_id"] = job["id"]
+        rows.append(row)
+    total = dict(zip(SUMMARY_FIELDS, aggregate(0, len(columns[0])) if len(columns[0]) > 0 else empty))
+    total["type"] = "total"
+    total["job_id"] = "all jobs"
+    return {"jobs": rows, "total": total}
 
 def metric_to_list(metric):
     return [
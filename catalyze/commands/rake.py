@@ -1,15 +1,33 @@
 from __future__ import absolute_import
 
-import click
-from catalyze import cli, client, project, output
-from catalyze.helpers import services
+import click, sys
+from catalyze import cli, client, project, output, pool
+from catalyze.helpers import services, tasks
 
 @cli.command(short_help = "Execute a rake task")
-@click.argument("task_name")
-def rake(task_name):
-    """Execute a rake task. This is only applicable to ruby-based applications."""
+@click.argument("task_names", nargs = -1)
+@click.option("--file", "tasks_file", type = click.File("r"), default = None, help = "Read rake task names from this file, one per line.")
+@click.option("--concurrency", type = int, default = pool.default_workers, help = "How many rake tasks to start at once.")
+@click.option("--track", is_flag = True, default = False, help = "Wait for every rake task to finish and summarize the results.")
+@click.option("--timeout", type = int, default = 3600, help = "With --track, how many seconds to wait for each rake task before counting it as failed.")
+def rake(task_names, tasks_file, concurrency, track, timeout):
+    """Execute a rake task. This is only applicable to ruby-based applications.
+
+Several tasks can be given at once, as arguments or with --file. They are all started concurrently over one session."""
+    task_names = list(task_names) + (tasks.read_names(tasks_file) if tasks_file is not None else [])
+    if len(task_names) == 0:
+        output.error("At least one rake task name is required.")
     settings = project.read_settings()
     session = client.acquire_session(settings)
-    output.write("Executing Rake Task: {}".format(task_name))
-    resp = services.initiate_rake(session, settings["environmentId"], settings["serviceId"], task_name)
+    if len(task_names) == 1 and not track:
+        output.write("Executing Rake Task: {}".format(task_names[0]))
+        resp = services.initiate_rake(session, settings["environmentId"], settings["serviceId"], task_names[0])
+        output.write("Rake task output viewable in the logging server.")
+        return
+    output.write("Executing %d Rake Tasks" % (len(task_names),))
+    failures = tasks.launch_many(session, settings["environmentId"], task_names,
+            lambda task_name: services.initiate_rake(session, settings["environmentId"], settings["serviceId"], task_name),
+            concurrency, track, timeout)
     output.write("Rake task output viewable in the logging server.")
+    if failures > 0:
+        sys.exit(-1)
@@ -1,15 +1,41 @@
 from __future__ import absolute_import
 
-from catalyze import cli, client, config, project, output
+from catalyze import cli, client, config, project, output, pool
 from catalyze.helpers import services
 import click
 
 @cli.command(short_help = "Redeploy without pushing")
-def redeploy():
-    """Redeploy an environment's service manually."""
+@click.option("--services", "service_labels", default = None, help = "Comma-separated labels of the code services to redeploy instead of the associated one.")
+@click.option("--all-code", is_flag = True, default = False, help = "Redeploy every code service in the environment.")
+@click.option("--rolling", type = int, default = 0, help = "Redeploy this many services at a time, waiting for each batch to finish deploying before starting the next.")
+@click.option("--timeout", type = int, default = 900, help = "With --rolling, how many seconds to wait for each batch before stopping the rollout.")
+def redeploy(service_labels, all_code, rolling, timeout):
+    """Redeploy an environment's service manually.
+
+With --services or --all-code, several code services are redeployed concurrently. With --rolling N they are redeployed N at a time, and the rollout stops if a batch does not come back up."""
     settings = project.read_settings()
     session = client.acquire_session(settings)
-    service_id = settings["serviceId"]
-    output.write("Redeploying " + service_id)
-    services.redeploy(session, settings["environmentId"], service_id)
+    if service_labels is None and not all_code:
+        service_id = settings["serviceId"]
+        output.write("Redeploying " + service_id)
+        services.redeploy(session, settings["environmentId"], service_id)
+        output.write("Redeploy successful, check status and logs for updates")
+        return
+
+    targets = services.select_code_services(session, settings["environmentId"], (service_labels or "").split(","), all_code)
+    batches = [targets] if rolling <= 0 else [targets[i:i + rolling] for i in range(0, len(targets), rolling)]
+    for batch in batches:
+        output.write("Redeploying " + ", ".join([svc["label"] for svc in batch]))
+        results = pool.map(lambda svc: services.redeploy(session, settings["environmentId"], svc["id"]), batch)
+        failed = [svc["label"] for svc, (result, error) in zip(batch, results) if error is not None]
+        if failed:
+            output.error("Redeploy failed for " + ", ".join(failed))
+        if rolling > 0:
+            output.write("Waiting for the batch to finish deploying", sameline = True)
+            statuses = services.poll_deploys(session, settings["environmentId"], dict([(svc["id"], svc.get("deploy_status")) for svc in batch]),
+                    timeout = timeout)
+            output.write("")
+            unhealthy = ["%s (%s)" % (svc["label"], statuses.get(svc["id"])) for svc in batch if statuses.get(svc["id"]) != "running"]
+            if unhealthy:
+                output.error("Stopping the rollout, these services did not come back up: " + ", ".join(unhealthy))
     output.write("Redeploy successful, check status and logs for updates")
@@ -1,23 +1,121 @@
 from __future__ import absolute_import
 
-import json
-from catalyze import cli, client, project, output
+import json, time, click
+from catalyze import cli, client, project, output, pool
 from catalyze.helpers import environments, services
 
 @cli.command(short_help = "Quick status readout")
-def status():
-    """Check the status of the environment and every service in it."""
+@click.option("--watch", is_flag = True, default = False, help = "Keep polling and print each service status change as it happens.")
+@click.option("--interval", type = int, default = 2, help = "How many seconds to wait between polls with --watch.")
+@click.option("--all-envs", is_flag = True, default = False, help = "Show the services of every environment you have access to, unhealthy ones first.")
+@click.option("--workers", type = int, default = pool.default_workers, help = "How many environments to query at once with --all-envs.")
+def status(watch, interval, all_envs, workers):
+    """Check the status of the environment and every service in it.
+
+With --watch, the same session keeps polling with conditional requests, and only changes to the environment state or a service's build or deploy status are printed, each with a timestamp. Stop with Ctrl-C.
+
+With --all-envs, the services of every environment are fetched concurrently and shown in one table, with unhealthy services listed first."""
+    if all_envs:
+        if watch:
+            output.error("--watch cannot be used with --all-envs.")
+        status_all(workers)
+        return
     settings = project.read_settings()
     session = client.acquire_session(settings)
-    env = environments.retrieve(session, settings["environmentId"])
-    output.write("environment state: " + env["state"])
+    env_id = settings["environmentId"]
+    (env, env_etag), (svcs, svcs_etag) = fetch(session, env_id)
+    output.record({"environmentState": env["state"]}, "environment state: " + env["state"])
     codes = []
     noncodes = []
-    for service in services.list(session, settings["environmentId"]):
+    for service in svcs:
         if service["type"] != "utility":
             if service["type"] == "code":
-                codes.append("\t%s (size = %s, build status = %s, deploy status = %s)" % (service["label"], service["size"], service["build_status"], service["deploy_status"]))
+                codes.append((service, "\t%s (size = %s, build status = %s, deploy status = %s)" % (service["label"], service["size"], service["build_status"], service["deploy_status"])))
             else:
-                noncodes.append("\t%s (size = %s, image = %s, status = %s)" % (service["label"], service["size"], service["name"], service["deploy_status"]))
-    for item in (codes + noncodes):
-        output.write(item)
+                noncodes.append((service, "\t%s (size = %s, image = %s, status = %s)" % (service["label"], service["size"], service["name"], service["deploy_status"])))
+    for service, item in (codes + noncodes):
+        output.record(dict([(key, service.get(key)) for key in ["label", "type", "size", "name", "build_status", "deploy_status"]]), item)
+    if not watch:
+        return
+
+    state = env["state"]
+    statuses = service_statuses(svcs)
+    try:
+        while True:
+            time.sleep(interval)
+            (env, env_etag), (svcs, svcs_etag) = fetch(session, env_id, env_etag, svcs_etag)
+            now = time.strftime("%H:%M:%S")
+            if env is not None and env["state"] != state:
+                output.record({"time": now, "environmentState": env["state"], "previous": state},
+                        "%s environment state: %s -> %s" % (now, state, env["state"]))
+                state = env["state"]
+            if svcs is not None:
+                current = service_statuses(svcs)
+                for label in sorted(set(statuses.keys()) | set(current.keys())):
+                    for field in ["build_status", "deploy_status"]:
+                        before = statuses.get(label, {}).get(field)
+                        after = current.get(label, {}).get(field)
+                        if before != after:
+                            output.record({"time": now, "service": label, "field": field, "previous": before, "current": after},
+                                    "%s %s %s: %s -> %s" % (now, label, field.replace("_", " "), before, after))
+                statuses = current
+    except KeyboardInterrupt:
+        pass
+
+def status_all(workers):
+    session = client.acquire_session(project.read_settings(required = False))
+    envs = environments.list(session)
+    results = session.map_calls(lambda env: services.list(session, env["environmentId"]), envs, max_workers = workers)
+    rows = []
+    failed = 0
+    for env, (svcs, error) in zip(envs, results):
+        name = env["data"]["name"]
+        if error is not None:
+            failed += 1
+            rows.append((False, name, None, None, None, "error: %s" % (error if not isinstance(error, SystemExit) else "see above",)))
+            continue
+        for service in svcs:
+            if service["type"] != "utility":
+                build = service.get("build_status") if service["type"] == "code" else None
+                rows.append((is_healthy(service), name, service["label"], service["type"], build, service.get("deploy_status")))
+    rows.sort(key = lambda row: (row[0], row[1], row[2] or ""))
+    if output.json_mode:
+        for row in rows:
+            output.record(dict(zip(["healthy", "environment", "service", "type", "build_status", "deploy_status"], row)))
+        return
+    # missing values are only shown as "-" in the table; JSON records keep them as null
+    table = [("", "ENVIRONMENT", "SERVICE", "TYPE", "BUILD", "DEPLOY")] + \
+            [("" if row[0] else "!",) + tuple(["-" if value is None else value for value in row[1:]]) for row in rows]
+    widths = [max([len(str(row[i])) for row in table]) for i in range(len(table[0]))]
+    for row in table:
+        output.write("  ".join([str(value).ljust(width) for value, width in zip(row, widths)]).rstrip())
+    unhealthy = len([row for row in rows if not row[0]]) - failed
+    output.write("%d of %d services unhealthy across %d environments" % (unhealthy, len(rows) - failed, len(envs) - failed))
+    if failed > 0:
+        output.write("%d environments could not be checked" % (failed,))
+
+HEALTHY_BUILD_STATUSES = [None, "finished"]
+HEALTHY_DEPLOY_STATUSES = ["running"]
+
+def is_healthy(service):
+    if service["type"] == "code" and service.get("build_status") not in HEALTHY_BUILD_STATUSES:
+        return False
+    return service.get("deploy_status") in HEALTHY_DEPLOY_STATUSES
+
+def fetch(session, env_id, env_etag = None, svcs_etag = None):
+    """Retrieves the environment and its services concurrently. Either body is None if it is unchanged since the
+    given ETag."""
+    results = pool.map(lambda request: request(), [
+        lambda: environments.retrieve_if_changed(session, env_id, env_etag),
+        lambda: services.list_if_changed(session, env_id, svcs_etag)
+    ])
+    for result, error in results:
+        if error is not None:
+            raise error
+    return [result for result, error in results]
+
+def service_statuses(svcs):
+    return dict([(service["label"], {
+        "build_status": service.get("build_status"),
+        "deploy_status": service.get("deploy_status")
+    }) for service in svcs if service["type"] != "utility"])
@@ -11,4 +11,4 @@ def support_ids():
     session = client.acquire_session(settings)
     del settings["token"]
     for pair in settings.items():
-        output.write("%s: %s" % pair)
\ No newline at end of file
+        output.record({"name": pair[0], "value": pair[1]}, "%s: %s" % pair)
\ No newline at end of file
@@ -1,40 +1,112 @@
 from __future__ import absolute_import
 
 import click
-from catalyze import cli, client, project, output
+import sys
+import time
+from catalyze import cli, client, project, output, pool
 from catalyze.helpers import environments
 
 @cli.command(short_help = "Retrieve your user ID")
 def whoami():
     """Prompts for login, and prints out your ID so that you can be added to an environment by someone else."""
     session = client.acquire_session()
-    output.write("user ID = " + session.user_id)
+    output.record({"userId": session.user_id}, "user ID = " + session.user_id)
 
-@cli.command(short_help = "Add a user to the environment")
-@click.argument("user_id")
-def adduser(user_id):
-    """Adds another user to the associated environment. The ID required is found via 'catalyze whoami'."""
-    settings = project.read_settings()
-    session = client.acquire_session(settings)
-    environments.add_user(session, settings["environmentId"], user_id)
-    output.write("Added.")
+@cli.command(short_help = "Add users to the environment")
+@click.argument("user_ids", nargs = -1)
+@click.option("--file", "id_file", type = click.File("r"), default = None, help = "Also add the IDs listed in this file, one per line ('-' for stdin).")
+@click.option("--env", "env_labels", multiple = True, help = "Add the users to this environment instead of the associated one. May be repeated.")
+@click.option("--workers", type = int, default = pool.default_workers, help = "How many requests to send at once.")
+def adduser(user_ids, id_file, env_labels, workers):
+    """Adds other users to the associated environment. The IDs required are found via 'catalyze whoami'.
 
-@cli.command(short_help = "Remove a user from the environment")
-@click.argument("user_id")
-def rmuser(user_id):
-    """Removes another user from the associated environment. The ID required is found via 'catalyze whoami'."""
-    settings = project.read_settings()
-    session = client.acquire_session(settings)
-    environments.remove_user(session, settings["environmentId"], user_id)
-    output.write("Removed.")
+Users who are already members are skipped; the rest are added concurrently."""
+    change_membership("add", user_ids, id_file, env_labels, workers)
+
+@cli.command(short_help = "Remove users from the environment")
+@click.argument("user_ids", nargs = -1)
+@click.option("--file", "id_file", type = click.File("r"), default = None, help = "Also remove the IDs listed in this file, one per line ('-' for stdin).")
+@click.option("--env", "env_labels", multiple = True, help = "Remove the users from this environment instead of the associated one. May be repeated.")
+@click.option("--workers", type = int, default = pool.default_workers, help = "How many requests to send at once.")
+def rmuser(user_ids, id_file, env_labels, workers):
+    """Removes other users from the associated environment. The IDs required are found via 'catalyze whoami'.
+
+Users who are not members are skipped; the rest are removed concurrently."""
+    change_membership("remove", user_ids, id_file, env_labels, workers)
 
 @cli.command(short_help = "List users for the environment")
 def users():
     """Lists users in the associated environment."""
     settings = project.read_settings()
     session = client.acquire_session(settings)
+    lines = []
     for user in environments.list_users(session, settings["environmentId"])["users"]:
-        if user == settings["user_id"]:
-            output.write("%s (you)" % (user,))
+        text = "%s (you)" % (user,) if user == settings["user_id"] else user
+        if output.json_mode:
+            output.record({"userId": user, "you": user == settings["user_id"]}, text)
+        else:
+            lines.append(text)
+    if len(lines) > 0:
+        output.write("\n".join(lines))
+
+def read_ids(user_ids, id_file):
+    """Merges the IDs given as arguments with those in id_file, dropping blank lines, '#' comments and duplicates."""
+    ids = list(user_ids)
+    if id_file is not None:
+        for line in id_file:
+            ids.extend(line.split("#", 1)[0].split())
+    unique = []
+    for user_id in ids:
+        if user_id not in unique:
+            unique.append(user_id)
+    return unique
+
+def change_membership(action, user_ids, id_file, env_labels, workers):
+    """
+    Adds or removes users in one or more environments. The current members of every environment are listed first,
+    so no-op changes are skipped without a request, and the remaining changes are sent concurrently over one session.
+    """
+    ids = read_ids(user_ids, id_file)
+    if len(ids) == 0:
+        output.error("At least one user ID or a --file is required.")
+    settings = project.read_settings(required = not env_labels)
+    session = client.acquire_session(settings)
+    if env_labels:
+        envs = environments.select(session, env_labels)
+    else:
+        envs = [(None, settings["environmentId"])]
+
+    started = time.time()
+    changes = []
+    names = []
+    done = 0
+    skipped = 0
+    failed = 0
+    for (name, env_id), (members, error) in zip(envs, environments.list_users_many(session, [env_id for name, env_id in envs], workers)):
+        if error is not None:
+            failed += 1
+            if not isinstance(error, SystemExit):
+                output.error("%s: %s" % (name or env_id, error), exit = False)
+            continue
+        for user_id in ids:
+            if (user_id in members["users"]) == (action == "add"):
+                skipped += 1
+            else:
+                changes.append((action, env_id, user_id))
+                names.append(name)
+
+    verb = "Added" if action == "add" else "Removed"
+    results = environments.change_users(session, changes, workers) if len(changes) > 0 else []
+    for (change, env_id, user_id), name, (result, error) in zip(changes, names, results):
+        target = user_id if name is None else "%s in %s" % (user_id, name)
+        if error is None:
+            done += 1
+            output.record({"userId": user_id, "environmentId": env_id, "action": change, "status": "done"}, "%s %s" % (verb, target))
         else:
-            output.write(user)
+            failed += 1
+            output.record({"userId": user_id, "environmentId": env_id, "action": change, "status": "failed", "error": str(error)},
+                    "Failed: %s (%s)" % (target, error if not isinstance(error, SystemExit) else "see above"))
+    output.write("%s %d, skipped %d (%s), failed %d in %.1fs" % (verb, done, skipped,
+            "already members" if action == "add" else "not members", failed, time.time() - started))
+    if failed > 0:
+        sys.exit(-1)
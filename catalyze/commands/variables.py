@@ -1,29 +1,47 @@
 from __future__ import absolute_import
 
-import json, itertools, click
+import json, itertools, sys, click
 
-from catalyze import cli, client, project, config, output
+from catalyze import cli, client, project, config, output, pool
 from catalyze.helpers import services, environment_variables
 
 @cli.group("vars", short_help = "Check/set/unset environment variables")
 def vars_group():
     """Interacts with environment variables for the associated environment."""
 
+def services_option(func):
+    func = click.option("--all-code", is_flag = True, default = False, help = "Apply to every code service in the environment.")(func)
+    return click.option("--services", "service_labels", default = None, help = "Comma-separated labels of the code services to apply to instead of the associated one.")(func)
+
 @vars_group.command()
-def list():
+@services_option
+def list(service_labels, all_code):
     """List all set variables."""
     settings = project.read_settings()
     session = client.acquire_session(settings)
-    service = session.get("%s/v1/environments/%s/services/%s" % (config.paas_host, settings["environmentId"], settings["serviceId"]), verify = True)
-    variables = service["environmentVariables"]
-    for value, key in sorted(variables.items()):
-        output.write("%s = %s" % (value, key))
+    if service_labels is None and not all_code:
+        variables = current_variables(session, settings["environmentId"], settings["serviceId"])
+        for value, key in sorted(variables.items()):
+            output.record({"key": value, "value": key}, "%s = %s" % (value, key))
+        return
+    targets = services.select_code_services(session, settings["environmentId"], (service_labels or "").split(","), all_code)
+    results = pool.map(lambda svc: current_variables(session, settings["environmentId"], svc["id"]), targets)
+    for svc, (variables, error) in zip(targets, results):
+        output.write(svc["label"] + ":")
+        if error is not None:
+            output.write("    could not be retrieved (%s)" % (error if not isinstance(error, SystemExit) else "see above",))
+            continue
+        for value, key in sorted(variables.items()):
+            output.record({"service": svc["label"], "key": value, "value": key}, "    %s = %s" % (value, key))
 
 @vars_group.command(short_help = "Set or update a variable.")
 @click.argument("variables", nargs = -1)
-def set(variables):
+@services_option
+def set(variables, service_labels, all_code):
     """Set or update one or more variables. Expects variables in the form <key>=<value>. Multiple variables can be set at once.
 
+With --services or --all-code, the variables are set on several code services concurrently.
+
 Variable changes will not take effect in the application until it is redeployed (via either a push or 'catalyze redeploy')."""
     settings = project.read_settings()
     session = client.acquire_session(settings)
@@ -34,7 +52,15 @@ Variable changes will not take effect in the application until it is redeployed
             output.error("Expected argument form: <key>=<value>")
         else:
             body[pieces[0]] = pieces[1]
-    environment_variables.set(session, settings["environmentId"], settings["serviceId"], body)
+    if service_labels is None and not all_code:
+        environment_variables.set(session, settings["environmentId"], settings["serviceId"], body)
+        return
+    targets = services.select_code_services(session, settings["environmentId"], (service_labels or "").split(","), all_code)
+    results = pool.map(lambda svc: environment_variables.set(session, settings["environmentId"], svc["id"], body), targets)
+    failed = [svc["label"] for svc, (result, error) in zip(targets, results) if error is not None]
+    output.write("Set on %d of %d services" % (len(targets) - len(failed), len(targets)))
+    if failed:
+        output.error("Could not set variables on " + ", ".join(failed))
 
 @vars_group.command()
 @click.argument("variable")
@@ -45,3 +71,91 @@ Variable changes will not take effect in the application until it is redeployed
     settings = project.read_settings()
     session = client.acquire_session(settings)
     environment_variables.unset(session, settings["environmentId"], settings["serviceId"], variable)
+
+@vars_group.command("import", short_help = "Sync variables from a .env file.")
+@click.argument("env_file", type = click.File("r"))
+@click.option("--dry-run", is_flag = True, default = False, help = "Only show what would change.")
+@click.option("--keep-missing", is_flag = True, default = False, help = "Do not unset variables that are missing from the file.")
+def import_vars(env_file, dry_run, keep_missing):
+    """Makes the service's variables match a .env file (one <key>=<value> per line, "-" for stdin).
+
+The current variables are fetched once and compared to the file. Added and changed variables are sent in a single update, and variables missing from the file are unset concurrently.
+
+Variable changes will not take effect in the application until it is redeployed (via either a push or 'catalyze redeploy')."""
+    wanted = parse_env(env_file.read())
+    settings = project.read_settings()
+    session = client.acquire_session(settings)
+    current = current_variables(session, settings["environmentId"], settings["serviceId"])
+    changed = dict([(key, value) for key, value in wanted.items() if current.get(key) != value])
+    removed = [] if keep_missing else sorted([key for key in current if key not in wanted])
+    for key in sorted(changed):
+        output.record({"change": "update" if key in current else "add", "key": key}, "%s %s" % ("~" if key in current else "+", key))
+    for key in removed:
+        output.record({"change": "remove", "key": key}, "- %s" % (key,))
+    if not changed and not removed:
+        output.write("Already up to date.")
+        return
+    if dry_run:
+        output.write("%d to set, %d to unset (dry run, nothing changed)" % (len(changed), len(removed)))
+        return
+    if changed:
+        environment_variables.set(session, settings["environmentId"], settings["serviceId"], changed)
+    results = pool.map(lambda key: environment_variables.unset(session, settings["environmentId"], settings["serviceId"], key), removed)
+    failed = [key for key, (result, error) in zip(removed, results) if error is not None]
+    for key in failed:
+        output.error("Could not unset %s" % (key,), exit = False)
+    output.write("%d set, %d unset" % (len(changed), len(removed) - len(failed)))
+    if failed:
+        sys.exit(-1)
+
+@vars_group.command("export", short_help = "Write variables to a .env file.")
+@click.argument("env_file", type = click.File("w"), default = "-")
+def export_vars(env_file):
+    """Writes the service's variables in .env format to a file, or to stdout if no file or "-" is given."""
+    settings = project.read_settings()
+    session = client.acquire_session(settings)
+    variables = current_variables(session, settings["environmentId"], settings["serviceId"])
+    env_file.write("".join(["%s=%s\n" % (key, quote_env_value(value)) for key, value in sorted(variables.items())]))
+
+def current_variables(session, env_id, svc_id):
+    service = session.get("%s/v1/environments/%s/services/%s" % (config.paas_host, env_id, svc_id), verify = True)
+    return service["environmentVariables"]
+
+ENV_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "\"": "\"", "\\": "\\", "$": "$"}
+
+def parse_env(text):
+    """Parses .env contents into a dict. Supports comments, blank lines, an optional "export " prefix, and single
+    (literal) or double (backslash escaped) quoted values."""
+    variables = {}
+    for number, line in enumerate(text.splitlines()):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("export "):
+            line = line[len("export "):].lstrip()
+        pieces = line.split("=", 1)
+        if len(pieces) != 2 or not pieces[0].strip():
+            output.error("Line %d: expected <key>=<value>" % (number + 1,))
+        key, value = pieces[0].strip(), pieces[1].strip()
+        if len(value) >= 2 and value[0] == value[-1] == "'":
+            value = value[1:-1]
+        elif len(value) >= 2 and value[0] == value[-1] == "\"":
+            chars = []
+            i = 1
+            while i < len(value) - 1:
+                if value[i] == "\\" and i + 1 < len(value) - 1:
+                    chars.append(ENV_ESCAPES.get(value[i + 1], "\\" + value[i + 1]))
+                    i += 2
+                else:
+                    chars.append(value[i])
+                    i += 1
+            value = "".join(chars)
+        else:
+            value = value.split(" #", 1)[0].rstrip()
+        variables[key] = value
+    return variables
+
+def quote_env_value(value):
+    if value and not any([c in value for c in " \t\r\n\"'#\\$"]):
+        return value
+    return "\"%s\"" % (value.replace("\\", "\\\\").replace("\"", "\\\"").replace("$", "\\$").replace("\n", "\\n").replace("\r", "\\r").replace("\t", "\\t"),)
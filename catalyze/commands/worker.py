@@ -1,15 +1,32 @@
 from __future__ import absolute_import
 
-import click
-from catalyze import cli, client, project, output
-from catalyze.helpers import services
+import click, sys
+from catalyze import cli, client, project, output, pool
+from catalyze.helpers import services, tasks
 
 @cli.command(short_help = "Start a background worker")
-@click.argument("target", default = "worker")#, help = "The name of the Procfile target to invoke as a worker.")
-def worker(target):
-    """Starts a Procfile target as a worker. Worker containers are intended to be short-lived, one-off tasks."""
+@click.argument("targets", nargs = -1)#, help = "The names of the Procfile targets to invoke as workers.")
+@click.option("--file", "targets_file", type = click.File("r"), default = None, help = "Read Procfile targets from this file, one per line.")
+@click.option("--concurrency", type = int, default = pool.default_workers, help = "How many workers to start at once.")
+@click.option("--track", is_flag = True, default = False, help = "Wait for every worker to finish and summarize the results.")
+@click.option("--timeout", type = int, default = 3600, help = "With --track, how many seconds to wait for each worker before counting it as failed.")
+def worker(targets, targets_file, concurrency, track, timeout):
+    """Starts a Procfile target as a worker. Worker containers are intended to be short-lived, one-off tasks.
+
+Several targets can be given at once, as arguments or with --file. They are all started concurrently over one session."""
+    targets = list(targets) + (tasks.read_names(targets_file) if targets_file is not None else [])
+    if len(targets) == 0:
+        targets = ["worker"]
     settings = project.read_settings()
     session = client.acquire_session(settings)
-    output.write("Initiating a background worker for Service: %s (procfile target = \"%s\")" % (settings['serviceId'], target))
-    services.initiate_worker(session, settings["environmentId"], settings["serviceId"], target)
-    output.write("Worker started.")
+    if len(targets) == 1 and not track:
+        output.write("Initiating a background worker for Service: %s (procfile target = \"%s\")" % (settings['serviceId'], targets[0]))
+        services.initiate_worker(session, settings["environmentId"], settings["serviceId"], targets[0])
+        output.write("Worker started.")
+        return
+    output.write("Initiating %d background workers for Service: %s" % (len(targets), settings['serviceId']))
+    failures = tasks.launch_many(session, settings["environmentId"], targets,
+            lambda target: services.initiate_worker(session, settings["environmentId"], settings["serviceId"], target),
+            concurrency, track, timeout)
+    if failures > 0:
+        sys.exit(-1)
@@ -0,0 +1,141 @@
+from __future__ import absolute_import
+
+# Shell completion. The completer runs on every TAB, so this module must stay cheap to import: it only reads a JSON
+# snapshot of the command tree and of the environment and service labels seen by earlier commands, and never imports
+# click, requests or the command modules, or touches the network.
+
+import json, os, sys
+
+CACHE_PATH = os.path.join(os.path.expanduser("~"), ".catalyze-completion.json")
+PROJECT_SETTINGS = os.path.join(".git", "catalyze-config.json")
+
+BASH_SCRIPT = """_catalyze_completion() {
+    COMPREPLY=( $(COMP_WORDS="${COMP_WORDS[*]}" COMP_CWORD=$COMP_CWORD _CATALYZE_COMPLETE=1 "${COMP_WORDS[0]}" 2>/dev/null) )
+}
+complete -o default -F _catalyze_completion catalyze
+"""
+
+ZSH_SCRIPT = "autoload -U +X bashcompinit && bashcompinit\n" + BASH_SCRIPT
+
+# labels seen during this run, written to the snapshot by save()
+seen_environments = None
+seen_services = {}
+
+def remember_environments(environments):
+    """Records the names of a complete environment list."""
+    global seen_environments
+    seen_environments = sorted([env["data"]["name"] for env in environments])
+
+def remember_services(env_id, services):
+    """Records the labels of a complete service list."""
+    seen_services[env_id] = sorted([svc["label"] for svc in services])
+
+def load():
+    try:
+        with open(CACHE_PATH, "r") as file:
+            return json.load(file)
+    except (IOError, OSError, ValueError):
+        return {}
+
+def save(cli, version):
+    """
+    Writes the labels seen during this run to the snapshot, and rebuilds the command tree if it is missing or from
+    another version. Runs at exit; the snapshot is only rewritten when something changed.
+    """
+    try:
+        snapshot = load()
+        updated = dict(snapshot)
+        if snapshot.get("version") != version or "commands" not in snapshot:
+            updated["version"] = version
+            updated["commands"] = command_tree(cli)
+        if seen_environments is not None:
+            updated["environments"] = seen_environments
+        if len(seen_services) > 0:
+            updated["services"] = dict(snapshot.get("services", {}), **seen_services)
+        if updated != snapshot:
+            temp_path = "%s.%d" % (CACHE_PATH, os.getpid())
+            with open(temp_path, "w") as file:
+                json.dump(updated, file)
+            os.rename(temp_path, CACHE_PATH)
+    except (IOError, OSError):
+        pass
+
+def label_kind(name):
+    if name in ["env_label", "env_labels"]:
+        return "environments"
+    if name in ["service_label", "service_labels", "database_label"]:
+        return "services"
+    return None
+
+def command_tree(command):
+    """Describes a click command and its subcommands as plain data for the completer."""
+    import click
+    node = {"options": {"--help": None}, "args": [], "variadic": False}
+    for param in command.params:
+        values = label_kind(param.name) or (sorted(param.type.choices) if isinstance(param.type, click.Choice) else "")
+        if isinstance(param, click.Option):
+            for opt in param.opts + param.secondary_opts:
+                node["options"][opt] = None if param.is_flag else values
+        else:
+            node["args"].append(values)
+            node["variadic"] = param.nargs == -1
+    if isinstance(command, click.MultiCommand):
+        node["commands"] = dict([(name, command_tree(sub)) for name, sub in command.commands.items()])
+    return node
+
+def candidates(snapshot, values):
+    """Expands a value description from the command tree into the possible values."""
+    if values == "environments":
+        return snapshot.get("environments", [])
+    if values == "services":
+        try:
+            with open(PROJECT_SETTINGS, "r") as file:
+                env_id = json.load(file)["environmentId"]
+        except (IOError, OSError, ValueError, KeyError):
+            return []
+        return snapshot.get("services", {}).get(env_id, [])
+    return values if isinstance(values, list) else []
+
+def complete_words(snapshot, words, current):
+    """
+    :param words: the words typed before the one being completed, without the program name
+    :param current: the (possibly empty) word being completed
+    :return: the possible completions of current
+    """
+    node = snapshot.get("commands")
+    if node is None:
+        return []
+    position = 0
+    expecting = False
+    for word in words:
+        if expecting is not False:
+            expecting = False
+        elif word.startswith("-"):
+            expecting = node["options"].get(word.split("=")[0], None) if "=" not in word else False
+            if expecting is None:
+                expecting = False
+        elif word in node.get("commands", {}):
+            node = node["commands"][word]
+            position = 0
+        else:
+            position += 1
+    if expecting is not False:
+        options = candidates(snapshot, expecting)
+    elif current.startswith("-"):
+        options = sorted(node["options"].keys())
+    elif "commands" in node:
+        options = sorted(node["commands"].keys())
+    elif position < len(node["args"]):
+        options = candidates(snapshot, node["args"][position])
+    elif node["variadic"] and len(node["args"]) > 0:
+        options = candidates(snapshot, node["args"][-1])
+    else:
+        options = []
+    return [option for option in options if option.startswith(current)]
+
+def complete():
+    """Prints the completions for the words bash passes in COMP_WORDS and COMP_CWORD, one per line."""
+    words = os.environ.get("COMP_WORDS", "").split()
+    index = int(os.environ.get("COMP_CWORD", "0") or 0)
+    current = words[index] if index < len(words) else ""
+    sys.stdout.write("\n".join(complete_words(load(), words[1:index], current)) + "\n")
@@ -10,3 +10,10 @@ api_key = "32a384f5-5d11-4214-812e-b35ced9af4d7"
 behavior = {}
 
 version = "1.4.2"
+
+# None picks the fastest available backend (see helpers/AESCrypto.py)
+crypto_backend = None
+crypto_chunk_size = 256 * 1024
+
+# bytes per second for uploads and downloads, None for unlimited (see helpers/transfer.py)
+limit_rate = None
@@ -1,18 +1,146 @@
 import base64
 import binascii
+import os
 import struct
+import time
 
-from Crypto.Cipher import AES
+from catalyze import config
+
+BLOCK_SIZE = 16
+
+
+class PyCryptoCipher(object):
+    """
+    AES-CBC through PyCrypto.
+    """
+    def __init__(self, key, iv):
+        from Crypto.Cipher import AES
+        self.cipher = AES.new(key, mode=AES.MODE_CBC, IV=iv)
+
+    def encrypt(self, data):
+        return self.cipher.encrypt(data)
+
+    def decrypt(self, data):
+        return self.cipher.decrypt(data)
+
+
+class CryptographyCipher(object):
+    """
+    AES-CBC through cryptography's OpenSSL backend, which uses AES-NI where the CPU has it.
+    """
+    def __init__(self, key, iv):
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+        from cryptography.hazmat.backends import default_backend
+        self.cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
+        self.encryptor = None
+        self.decryptor = None
+
+    def encrypt(self, data):
+        if self.encryptor is None:
+            self.encryptor = self.cipher.encryptor()
+        return self.encryptor.update(data)
+
+    def decrypt(self, data):
+        if self.decryptor is None:
+            self.decryptor = self.cipher.decryptor()
+        return self.decryptor.update(data)
+
+
+# fastest first
+BACKENDS = [
+    ("cryptography", CryptographyCipher),
+    ("pycrypto", PyCryptoCipher)
+]
+
+
+def available_backends():
+    """
+    Returns the names of the backends that can be imported, fastest first.
+    """
+    available = []
+    for name, backend in BACKENDS:
+        try:
+            backend(b"\0" * 32, b"\0" * BLOCK_SIZE)
+            available.append(name)
+        except ImportError:
+            pass
+    return available
+
+
+def new_cipher(key, iv, backend=None):
+    """
+    Creates a streaming AES-CBC cipher. Every backend produces identical bytes; calls to encrypt/decrypt continue the
+    chain, so data may be passed in any number of block-aligned chunks.
+
+    :param backend: the backend name, defaulting to $CATALYZE_CRYPTO_BACKEND, config.crypto_backend, or the fastest
+        available backend
+    """
+    name = backend or os.getenv("CATALYZE_CRYPTO_BACKEND") or config.crypto_backend
+    for backend_name, backend_class in BACKENDS:
+        if name is None or name == backend_name:
+            try:
+                return backend_class(key, iv)
+            except ImportError:
+                if name is not None:
+                    raise
+    raise ValueError("Unknown or unavailable crypto backend '%s'" % (name,))
+
+
+def chunk_size():
+    """
+    The number of bytes to encrypt or decrypt at a time: $CATALYZE_CRYPTO_CHUNK_SIZE or config.crypto_chunk_size,
+    rounded down to a whole number of AES blocks.
+    """
+    size = int(os.getenv("CATALYZE_CRYPTO_CHUNK_SIZE") or config.crypto_chunk_size)
+    return max(BLOCK_SIZE, size - size % BLOCK_SIZE)
+
+
+class Encryption(object):
+    """
+    Base Encryption class
+    """
+    def __init__(self, key, iv, backend=None, chunk_size=None):
+        self.key = key
+        self.init_vector = iv
+        self.backend = backend
+        self.chunk_size = chunk_size
+        # time spent in the cipher itself, excluding reads and writes
+        self.seconds = 0.0
+
+    def encrypt(self, in_file, out_file):
+        """
+        Encrypt everything read from in_file and write it to out_file. The plaintext is padded with 1 to 16 zero
+        bytes up to the block size. Returns the plaintext size.
+        """
+        cipher = new_cipher(self.key, self.init_vector, self.backend)
+        size = self.chunk_size or chunk_size()
+        total = 0
+        while True:
+            chunk = in_file.read(size)
+            total += len(chunk)
+            last = len(chunk) < size
+            if last:
+                chunk += b'\0' * (BLOCK_SIZE - len(chunk) % BLOCK_SIZE)
+            started = time.time()
+            encrypted = cipher.encrypt(chunk)
+            self.seconds += time.time() - started
+            out_file.write(encrypted)
+            if last:
+                return total
 
 
 class Decryption(object):
     """
     Base Decryption class
     """
-    def __init__(self, filepath, key, iv):
+    def __init__(self, filepath, key, iv, backend=None, chunk_size=None):
         self.filepath = filepath
         self.key = self.decode(key)
         self.init_vector = self.decode(iv)
+        self.backend = backend
+        self.chunk_size = chunk_size
+        # time spent in the cipher itself, excluding reads and writes
+        self.seconds = 0.0
 
     @staticmethod
     def decode(encoded_text):
@@ -28,11 +156,43 @@ class Decryption(object):
         with open(self.filepath, 'rb') as enc_file:
             origsize = struct.unpack('<Q', enc_file.read(struct.calcsize('Q')))[0]
             with open(output_filepath, 'wb') as plain_file:
-                cipher = AES.new(self.key, mode=AES.MODE_CBC, IV=self.init_vector)
-                chunk_size = 24*1024
+                cipher = new_cipher(self.key, self.init_vector, self.backend)
+                size = self.chunk_size or chunk_size()
                 while True:
-                    chunk = enc_file.read(chunk_size)
+                    chunk = enc_file.read(size)
                     if len(chunk) == 0:
                         break
                     plain_file.write(cipher.decrypt(chunk))
                 plain_file.truncate(origsize)
+
+    def decrypt_stream(self, chunks, out_file):
+        """
+        Decrypt ciphertext as it arrives and write the plaintext to out_file, which need not be seekable. The <Q
+        original size header comes first, so the padding can be dropped without seeking back. Returns the plaintext
+        size.
+
+        :param chunks: an iterable of ciphertext byte strings of any size, including the header
+        """
+        cipher = new_cipher(self.key, self.init_vector, self.backend)
+        header_size = struct.calcsize('Q')
+        pending = b''
+        remaining = None
+        for chunk in chunks:
+            pending += chunk
+            if remaining is None:
+                if len(pending) < header_size:
+                    continue
+                remaining = struct.unpack('<Q', pending[:header_size])[0]
+                origsize = remaining
+                pending = pending[header_size:]
+            usable = len(pending) - len(pending) % BLOCK_SIZE
+            if usable > 0:
+                started = time.time()
+                plain = cipher.decrypt(pending[:usable])[:remaining]
+                self.seconds += time.time() - started
+                pending = pending[usable:]
+                remaining -= len(plain)
+                out_file.write(plain)
+        if remaining is None or remaining > 0:
+            raise IOError("Encrypted stream ended early")
+        return origsize
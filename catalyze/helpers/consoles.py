@@ -0,0 +1,79 @@
+from __future__ import absolute_import
+
+# Bookkeeping for console jobs kept alive with 'catalyze console --keep-alive', recorded in the project settings
+# under "consoles" and keyed by service and command.
+
+import time
+from requests.exceptions import RequestException
+from catalyze import project
+from catalyze.client import ClientError
+from catalyze.helpers import services, jobs
+
+def entry_key(service_id, command):
+    return "%s:%s" % (service_id, command or "")
+
+def reuse(session, settings, service_id, command):
+    """Returns the job ID and credentials of a kept-alive console for this service and command if its job is still
+    running, or (None, None). A job that has ended is destroyed and forgotten; one whose state cannot be checked is
+    left for a later run."""
+    key = entry_key(service_id, command)
+    entry = settings.get("consoles", {}).get(key)
+    if entry is None:
+        return None, None
+    try:
+        job = jobs.retrieve(session, settings["environmentId"], service_id, entry["jobId"])
+    except ClientError as e:
+        if e.status_code != 404:
+            return None, None
+        job = None
+    if job is None or job["status"] not in ["scheduled", "queued", "started", "running"]:
+        discard(session, settings, key)
+        return None, None
+    return entry["jobId"], entry["creds"]
+
+def remember(session, settings, service_id, command, job_id, creds, keep_alive):
+    """Records a kept-alive console. A different job already recorded for the same service and command is destroyed
+    first; if that fails, nothing is recorded and False is returned so the caller destroys job_id instead."""
+    key = entry_key(service_id, command)
+    previous = settings.get("consoles", {}).get(key)
+    if previous is not None and previous["jobId"] != job_id and not discard(session, settings, key):
+        return False
+    settings.setdefault("consoles", {})[key] = {
+        "serviceId": service_id,
+        "jobId": job_id,
+        "creds": creds,
+        "expires": time.time() + keep_alive
+    }
+    project.save_settings(settings)
+    return True
+
+def forget(settings, service_id, command, job_id):
+    """Drops the recorded console for this service and command if it is job_id, which must already be destroyed."""
+    key = entry_key(service_id, command)
+    entry = settings.get("consoles", {}).get(key)
+    if entry is not None and entry["jobId"] == job_id:
+        del settings["consoles"][key]
+        project.save_settings(settings)
+
+def discard(session, settings, key):
+    """Destroys a recorded console job and then forgets it. Returns False, keeping the entry for a later attempt, if
+    the job could not be destroyed."""
+    entry = settings["consoles"][key]
+    try:
+        services.destroy_console(session, settings["environmentId"], entry["serviceId"], entry["jobId"])
+    except ClientError as e:
+        if e.status_code != 404:
+            return False
+    del settings["consoles"][key]
+    project.save_settings(settings)
+    return True
+
+def reap(session, settings):
+    """Destroys every kept-alive console job whose idle period has run out. Called by client.acquire_session, so
+    any command run with the project settings cleans up; it makes no requests unless something has expired."""
+    consoles = settings.get("consoles", {})
+    for name in [name for name, entry in consoles.items() if entry["expires"] < time.time()]:
+        try:
+            discard(session, settings, name)
+        except RequestException:
+            pass
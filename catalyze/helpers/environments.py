@@ -1,19 +1,54 @@
 from __future__ import absolute_import
 
-from catalyze import config, output
+from catalyze import completion, config, output, pool
 
 def list(session):
     route = "%s/v1/environments?pageSize=1000" % (config.paas_host,)
-    return session.get(route, verify = True)
+    envs = session.get(route, verify = True)
+    completion.remember_environments(envs)
+    return envs
+
+def iterate(session):
+    """Like list, but yields each environment as soon as it has been received."""
+    route = "%s/v1/environments?pageSize=1000" % (config.paas_host,)
+    envs = []
+    for env in session.get_items(route):
+        envs.append(env)
+        yield env
+    # only a list that was read to the end is complete enough to complete labels from
+    completion.remember_environments(envs)
 
 def retrieve(session, env_id, source = "spec"):
     route = "%s/v1/environments/%s?source=%s" % (config.paas_host, env_id, source)
     return session.get(route, verify = True)
 
+def retrieve_if_changed(session, env_id, etag = None, source = "spec"):
+    route = "%s/v1/environments/%s?source=%s" % (config.paas_host, env_id, source)
+    return session.get_if_changed(route, etag)
+
 def list_users(session, env_id):
     route = "%s/v1/environments/%s/users" % (config.paas_host, env_id)
     return session.get(route, verify = True)
 
+def list_users_many(session, env_ids, max_workers = pool.default_workers):
+    """Lists the users of several environments concurrently. Returns (users, error) tuples in the same order as
+    env_ids."""
+    return session.map([("get", "%s/v1/environments/%s/users" % (config.paas_host, env_id)) for env_id in env_ids],
+            max_workers = max_workers)
+
+def change_users(session, changes, max_workers = pool.default_workers):
+    """
+    Adds and removes users concurrently.
+
+    :param changes: (action, env_id, user_id) tuples, where action is "add" or "remove"
+    :return: (body, error) tuples in the same order as changes
+    """
+    calls = []
+    for action, env_id, user_id in changes:
+        route = "%s/v1/environments/%s/users/%s" % (config.paas_host, env_id, user_id)
+        calls.append(("post", route, {}) if action == "add" else ("delete", route))
+    return session.map(calls, max_workers = max_workers)
+
 def add_user(session, env_id, user_id):
     route = "%s/v1/environments/%s/users/%s" % (config.paas_host, env_id, user_id)
     return session.post(route, {}, verify = True)
@@ -22,6 +57,17 @@ def remove_user(session, env_id, user_id):
     route = "%s/v1/environments/%s/users/%s" % (config.paas_host, env_id, user_id)
     return session.delete(route, verify = True)
 
+def select(session, env_labels, all_envs = False):
+    """Resolves environment labels to (name, ID) pairs with a single list call."""
+    envs = [(env["data"]["name"], env["environmentId"]) for env in list(session)]
+    if all_envs:
+        return envs
+    names = [name for name, env_id in envs]
+    for label in env_labels:
+        if label not in names:
+            output.error("No environment with label \"%s\" found." % (label,))
+    return [(name, env_id) for name, env_id in envs if name in env_labels]
+
 def retrieve_metrics(session, env_id, mins = 1):
     route = "%s/v1/environments/%s/metrics?mins=%d" % (config.paas_host, env_id, mins)
     return session.get(route, verify = True)
@@ -0,0 +1,123 @@
+from __future__ import absolute_import
+
+import json, os.path, sqlite3, time
+from catalyze import project
+
+PENDING_STATUSES = ["scheduled", "queued", "started", "running"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS services (
+    env_id TEXT NOT NULL,
+    service_id TEXT NOT NULL,
+    label TEXT NOT NULL,
+    etag TEXT,
+    synced_at REAL,
+    PRIMARY KEY (env_id, service_id)
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    env_id TEXT NOT NULL,
+    service_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    type TEXT,
+    status TEXT,
+    created_at TEXT,
+    summary TEXT NOT NULL,
+    detail TEXT,
+    PRIMARY KEY (env_id, id)
+);
+CREATE INDEX IF NOT EXISTS jobs_by_type ON jobs (env_id, type, created_at);
+CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (env_id, status, created_at);
+CREATE INDEX IF NOT EXISTS jobs_by_service ON jobs (env_id, service_id, created_at);
+"""
+
+def redact(job):
+    """Returns a copy of job without the backup, restore or log encryption keys, which are never written to disk."""
+    return dict([(name, dict([(k, v) for k, v in value.items() if k not in ["key", "iv"]]) if isinstance(value, dict) else value)
+            for name, value in job.items()])
+
+def default_path():
+    """The index lives next to the project settings, in the repository's .git directory."""
+    return os.path.join(os.path.dirname(project.FILE_PATH), "catalyze-jobs.db")
+
+class JobHistory(object):
+    """
+    A local SQLite index of job history, per environment and service. Each service's history is synced with a
+    conditional request, so an unchanged history costs a 304, and only new jobs or jobs whose status changed are
+    written. Job details fetched with jobs.retrieve are cached alongside the list entries. Encryption keys are
+    stripped before anything is stored.
+    """
+    def __init__(self, path = None):
+        self.db = sqlite3.connect(path or default_path())
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def etag(self, env_id, service_id):
+        row = self.db.execute("SELECT etag FROM services WHERE env_id = ? AND service_id = ?", (env_id, service_id)).fetchone()
+        return row[0] if row is not None else None
+
+    def last_synced(self, env_id):
+        """Returns {service label: sync time} for every service synced in the environment."""
+        return dict(self.db.execute("SELECT label, synced_at FROM services WHERE env_id = ?", (env_id,)).fetchall())
+
+    def update(self, env_id, service_id, label, jobs, etag):
+        """
+        Records a service's job list as returned by jobs.list, or just the sync time if jobs is None (unchanged).
+
+        :return: the number of jobs that were new or had changed
+        """
+        changed = 0
+        with self.db:
+            if jobs is not None:
+                known = dict(self.db.execute("SELECT id, status FROM jobs WHERE env_id = ? AND service_id = ?",
+                        (env_id, service_id)).fetchall())
+                for job_id, job in jobs.items():
+                    if known.get(job_id, False) == job.get("status"):
+                        continue
+                    changed += 1
+                    # a status change invalidates any cached detail
+                    self.db.execute("INSERT OR REPLACE INTO jobs (env_id, service_id, id, type, status, created_at, summary, detail) " +
+                            "VALUES (?, ?, ?, ?, ?, ?, ?, NULL)", (env_id, service_id, job_id, job.get("type"), job.get("status"),
+                            job.get("created_at"), json.dumps(redact(job))))
+            self.db.execute("INSERT OR REPLACE INTO services (env_id, service_id, label, etag, synced_at) VALUES (?, ?, ?, ?, ?)",
+                    (env_id, service_id, label, etag, time.time()))
+        return changed
+
+    def query(self, env_id, service_label = None, job_type = None, status = None, since = None, until = None, limit = None):
+        """
+        Returns matching jobs, newest first, as dicts with id, service, type, status and created_at.
+
+        :param since: only jobs created at or after this ISO 8601 date or time
+        :param until: only jobs created before this ISO 8601 date or time
+        """
+        sql = "SELECT jobs.id, services.label, jobs.type, jobs.status, jobs.created_at FROM jobs " + \
+                "JOIN services ON services.env_id = jobs.env_id AND services.service_id = jobs.service_id WHERE jobs.env_id = ?"
+        args = [env_id]
+        for clause, value in [("services.label = ?", service_label), ("jobs.type = ?", job_type), ("jobs.status = ?", status),
+                ("jobs.created_at >= ?", since), ("jobs.created_at < ?", until)]:
+            if value is not None:
+                sql += " AND " + clause
+                args.append(value)
+        sql += " ORDER BY jobs.created_at DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            args.append(limit)
+        return [dict(zip(["id", "service", "type", "status", "created_at"], row)) for row in self.db.execute(sql, args)]
+
+    def get(self, env_id, job_id):
+        """
+        Returns (service_id, job, detailed) for a job in the index or None. job is the cached detail if there is one,
+        otherwise the list entry.
+        """
+        row = self.db.execute("SELECT service_id, summary, detail FROM jobs WHERE env_id = ? AND id = ?", (env_id, job_id)).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[2] or row[1]), row[2] is not None
+
+    def save_detail(self, env_id, job_id, job):
+        """Caches a job retrieved with jobs.retrieve. Details of jobs that are still running are not kept."""
+        if job.get("status") in PENDING_STATUSES:
+            return
+        with self.db:
+            self.db.execute("UPDATE jobs SET detail = ? WHERE env_id = ? AND id = ?", (json.dumps(redact(job)), env_id, job_id))
@@ -1,15 +1,25 @@
 from __future__ import absolute_import
 
-from catalyze import config, output
+from catalyze import config, output, pool
 
 def list(session, env_id, svc_id):
     route = "%s/v1/environments/%s/services/%s/jobs" % (config.paas_host, env_id, svc_id)
     return session.get(route, verify = True)
 
+def list_if_changed(session, env_id, svc_id, etag = None):
+    """Like list, but returns a (jobs, etag) tuple where jobs is None if the history is unchanged since etag."""
+    route = "%s/v1/environments/%s/services/%s/jobs" % (config.paas_host, env_id, svc_id)
+    return session.get_if_changed(route, etag)
+
 def retrieve(session, env_id, svc_id, job_id):
     route = "%s/v1/environments/%s/services/%s/jobs/%s" % (config.paas_host, env_id, svc_id, job_id)
     return session.get(route, verify = True)
 
+def retrieve_many(session, env_id, svc_id, job_ids, max_workers = pool.default_workers):
+    """Retrieves several jobs concurrently. Returns (job, error) tuples in the same order as job_ids."""
+    return session.map([("get", "%s/v1/environments/%s/services/%s/jobs/%s" % (config.paas_host, env_id, svc_id, job_id)) \
+            for job_id in job_ids], max_workers = max_workers)
+
 def poll_until_complete(session, env_id, svc_id, job_id):
     while True:
         job = retrieve(session, env_id, svc_id, job_id)
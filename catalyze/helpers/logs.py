@@ -2,12 +2,10 @@ from __future__ import absolute_import
 
 from catalyze import output
 from catalyze.helpers import AESCrypto, services, jobs
-import os, os.path, uuid
-import requests
-import tempfile, shutil
+import io
 
 
-def dump(session, settings, service_label, service_id, task_id, task_type, file):
+def dump(session, settings, service_label, service_id, task_id, task_type, file, job = None):
     """
     Downloads and decrypts the logs for a given job. This job is typically a backup, restore, import, or
     export job. These logs are written to the path :param file: or output to the console if file is None.
@@ -20,33 +18,44 @@ def dump(session, settings, service_label, service_id, task_id, task_type, file)
     :param task_id: the ID of the task for which the logs are being retrieved, this **should not** be a job ID
     :param task_type: the type of task for which the logs are being retrieved (`backup` or `restore`)
     :param file: the name of the file to dump the logs to or None for console output
+    :param job: the job for task_id if the caller already has it (tasks.poll_status returns it), to save a request
     :return:
     """
     output.write("Retrieving %s logs for task %s ..." % (service_label, task_id))
-    # translate the task_id into a job
-    job = jobs.retrieve_from_task_id(session, settings["environmentId"], task_id)
-    url = services.get_temporary_logs_url(session, settings["environmentId"], service_id, task_type, job["id"])
-    r = requests.get(url, stream=True)
-    basename = os.path.basename(str(uuid.uuid4()))
-    dir = tempfile.mkdtemp()
-    tmp_filepath = os.path.join(dir, basename)
-    with open(tmp_filepath, 'wb+') as f:
-        for chunk in r.iter_content(chunk_size=1024):
-            if chunk:
-                f.write(chunk)
-                f.flush()
-    decryption = AESCrypto.Decryption(tmp_filepath, job[task_type]["key"], job[task_type]["iv"])
-    decrypted_tmp_filepath = os.path.join(dir, str(uuid.uuid4()))
-    decryption.decrypt(decrypted_tmp_filepath)
+    if job is None:
+        # translate the task_id into a job
+        job = jobs.retrieve_from_task_id(session, settings["environmentId"], task_id)
+    show(service_label, task_id, fetch(session, settings["environmentId"], service_id, task_type, job), file)
+
+
+def fetch(session, env_id, service_id, task_type, job, url = None):
+    """
+    Downloads and decrypts the logs for a job in memory and returns them. Nothing is printed, so this is safe to run
+    alongside other work.
+
+    :param job: the job, as returned by jobs.retrieve_from_task_id or tasks.poll_status
+    :param url: the temporary logs URL, if it has already been requested
+    :return: the decrypted logs
+    """
+    if url is None:
+        url = services.get_temporary_logs_url(session, env_id, service_id, task_type, job["id"])
+    r = session.get_file(url)
+    plaintext = io.BytesIO()
+    decryption = AESCrypto.Decryption(None, job[task_type]["key"], job[task_type]["iv"])
+    decryption.decrypt_stream(r.iter_content(chunk_size=AESCrypto.chunk_size()), plaintext)
+    return plaintext.getvalue()
+
+
+def show(service_label, task_id, data, file):
+    """
+    Writes logs returned by fetch to the path :param file: or to the console if file is None.
+    """
     if file is not None:
-        shutil.copy(decrypted_tmp_filepath, file)
-        output.write("Logs written to %s", (file,))
+        with open(file, 'wb') as f:
+            f.write(data)
+        output.write("Logs written to %s" % (file,))
     else:
         output.write("-------------------------- Begin %s logs --------------------------" % (service_label,))
-        with open(decrypted_tmp_filepath, 'r') as f:
-            for line in f:
-                output.write(line)
+        for line in data.splitlines(True):
+            output.record({"service": service_label, "taskId": task_id, "line": line.rstrip("\n")}, line)
         output.write("--------------------------  End %s logs  --------------------------" % (service_label,))
-    os.remove(tmp_filepath)
-    os.remove(decrypted_tmp_filepath)
-    os.removedirs(dir)
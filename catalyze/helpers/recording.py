@@ -0,0 +1,102 @@
+"""
+Console recordings are an append-only log of frames. The file starts with MAGIC, followed by one record per frame:
+
+    <d  seconds since the start of the recording
+    c   'i' for input sent to the console, 'o' for output received from it
+    I   length of the frame
+        the frame itself
+
+A sidecar index (<recording>.idx) holds fixed-size (<d seconds, <Q file offset) entries, at most one per
+INDEX_INTERVAL seconds, so that replay can binary search to a point in time without reading the whole recording.
+"""
+from __future__ import absolute_import
+
+import struct, threading, time, Queue
+
+MAGIC = b"CATREC\x01\x00"
+RECORD_HEADER = struct.Struct("<dcI")
+INDEX_ENTRY = struct.Struct("<dQ")
+INDEX_INTERVAL = 1.0
+
+class Recorder(object):
+    """
+    Records console frames. record() only enqueues the frame; a background thread does all disk writes so that the
+    interactive path never waits on the file.
+    """
+    def __init__(self, filepath):
+        self.file = open(filepath, "wb")
+        self.index = open(filepath + ".idx", "wb")
+        self.file.write(MAGIC)
+        self.start = time.time()
+        self.last = 0.0
+        self.next_index = 0.0
+        self.queue = Queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target = self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def record(self, kind, data):
+        with self.lock:
+            # time.time() can step backwards; keep timestamps non-decreasing so the index stays sorted
+            self.last = max(self.last, time.time() - self.start)
+            self.queue.put((self.last, kind, data))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+        self.index.close()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            ts, kind, data = item
+            if ts >= self.next_index:
+                self.index.write(INDEX_ENTRY.pack(ts, self.file.tell()))
+                self.next_index = ts + INDEX_INTERVAL
+            self.file.write(RECORD_HEADER.pack(ts, kind, len(data)))
+            self.file.write(data)
+            if self.queue.empty():
+                self.file.flush()
+                self.index.flush()
+
+def seek_offset(filepath, start):
+    """Returns the file offset of the last indexed record at or before start seconds."""
+    try:
+        index = open(filepath + ".idx", "rb")
+    except IOError:
+        return len(MAGIC)
+    with index:
+        index.seek(0, 2)
+        low, high = 0, index.tell() // INDEX_ENTRY.size
+        offset = len(MAGIC)
+        while low < high:
+            middle = (low + high) // 2
+            index.seek(middle * INDEX_ENTRY.size)
+            ts, position = INDEX_ENTRY.unpack(index.read(INDEX_ENTRY.size))
+            if ts <= start:
+                offset = position
+                low = middle + 1
+            else:
+                high = middle
+        return offset
+
+def read_frames(filepath, start = 0.0):
+    """Yields (seconds, kind, data) for every frame recorded at or after start seconds."""
+    with open(filepath, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a console recording" % (filepath,))
+        file.seek(seek_offset(filepath, start))
+        while True:
+            header = file.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            ts, kind, length = RECORD_HEADER.unpack(header)
+            data = file.read(length)
+            if len(data) < length:
+                return
+            if ts >= start:
+                yield ts, kind, data
@@ -1,12 +1,31 @@
 from __future__ import absolute_import
 
-from catalyze import config, output, client
+from catalyze import completion, config, output, client, pool
 from catalyze.client import ClientError, is_ok
 import urllib, json, time
 
 def list(session, env_id):
     route = "%s/v1/environments/%s?source=pod" % (config.paas_host, env_id)
-    return session.get(route, verify = True)["data"]["services"]
+    services = session.get(route, verify = True)["data"]["services"]
+    completion.remember_services(env_id, services)
+    return services
+
+def iterate(session, env_id):
+    """Like list, but yields each service as soon as it has been received."""
+    route = "%s/v1/environments/%s?source=pod" % (config.paas_host, env_id)
+    services = []
+    for service in session.get_items(route, ["data", "services"]):
+        services.append(service)
+        yield service
+    # only a list that was read to the end is complete enough to complete labels from
+    completion.remember_services(env_id, services)
+
+def list_if_changed(session, env_id, etag = None):
+    route = "%s/v1/environments/%s?source=pod" % (config.paas_host, env_id)
+    body, etag = session.get_if_changed(route, etag)
+    if body is not None:
+        completion.remember_services(env_id, body["data"]["services"])
+    return (None if body is None else body["data"]["services"]), etag
 
 def initiate_rake(session, env_id, svc_id, task_name):
     route = "%s/v1/environments/%s/services/%s/rake/%s" % \
@@ -17,17 +36,65 @@ def redeploy(session, env_id, svc_id):
     route = "%s/v1/environments/%s/services/%s/redeploy" % (config.paas_host, env_id, svc_id)
     return session.post(route, {}, verify = True)
 
+def poll_deploys(session, env_id, before, interval = 5, timeout = None):
+    """
+    Waits until every given service has been redeployed and has a settled deploy status. A service only counts as
+    redeployed once its status differs from the one it had before the redeploy was requested or has left the settled
+    states, so the old "running" status seen by the first poll is not mistaken for the end of the deploy.
+
+    :param before: a dict of service ID to deploy status, taken before the redeploys were requested
+    :param timeout: give up after this many seconds
+    :return: a dict of service ID to status, where a service that is no longer listed is "missing" and one still
+        deploying when the timeout ran out is "timed out"
+    """
+    settled = ["running", "failed", "stopped"]
+    started = time.time()
+    changed = set()
+    while True:
+        time.sleep(interval)
+        current = dict([(svc["id"], svc.get("deploy_status")) for svc in list(session, env_id)])
+        statuses = dict([(svc_id, current.get(svc_id, "missing")) for svc_id in before])
+        for svc_id, status in statuses.items():
+            if status != before[svc_id] or status not in settled:
+                changed.add(svc_id)
+        pending = [svc_id for svc_id, status in statuses.items() if status != "missing" and (svc_id not in changed or status not in settled)]
+        if len(pending) == 0:
+            return statuses
+        if timeout is not None and time.time() - started >= timeout:
+            for svc_id in pending:
+                statuses[svc_id] = "timed out"
+            return statuses
+        output.write(".", sameline = True)
+
 def get_by_label(session, env_id, label):
-    for service in list(session, env_id):
+    for service in iterate(session, env_id):
         if service["label"] == label:
             return service["id"]
     output.error("Could not find service with label '%s'" % (label,))
 
+def select_code_services(session, env_id, labels = None, all_code = False):
+    """Returns the code services with the given labels, or every code service if all_code is set."""
+    code_services = [svc for svc in list(session, env_id) if svc["type"] == "code"]
+    if all_code:
+        return code_services
+    found = [svc["label"] for svc in code_services]
+    labels = [label.strip() for label in labels if label.strip()]
+    for label in labels:
+        if label not in found:
+            output.error("No code service found with label '%s'. Labels found: %s" % (label, ", ".join(found)))
+    return [svc for svc in code_services if svc["label"] in labels]
+
 def list_backups(session, env_id, svc_id, page_number, page_size):
     route = "%s/v1/environments/%s/services/%s/backup?pageNum=%d&pageSize=%d" % \
             (config.paas_host, env_id, svc_id, int(page_number), int(page_size))
     return session.get(route, verify = True)
 
+def list_backups_many(session, env_id, svc_ids, page_number, page_size, max_workers = pool.default_workers):
+    """Lists the same page of backups for several services concurrently. Returns (backups, error) tuples in the same
+    order as svc_ids."""
+    return session.map([("get", "%s/v1/environments/%s/services/%s/backup?pageNum=%d&pageSize=%d" % \
+            (config.paas_host, env_id, svc_id, int(page_number), int(page_size))) for svc_id in svc_ids], max_workers = max_workers)
+
 def create_backup(session, env_id, svc_id):
     route = "%s/v1/environments/%s/services/%s/backup" % (config.paas_host, env_id, svc_id)
     body = {
@@ -56,8 +123,8 @@ def get_temporary_logs_url(session, env_id, svc_id, task_type, task_id):
     route = "%s/v1/environments/%s/services/%s/%s/%s/logs/url" % (config.paas_host, env_id, svc_id, task_type, task_id)
     return session.get(route, verify = True)["url"]
 
-def initiate_import(session, env_id, svc_id, url, file, key, iv, wipe_first, options):
-    session.put_file(url, file, verify = True)
+def initiate_import(session, env_id, svc_id, url, file, key, iv, wipe_first, options, meter = None):
+    session.put_file(url, file, verify = True, meter = meter)
     parameters = {
         "location": url,
         "key": key,
@@ -91,13 +158,18 @@ def console_job_status(session, env_id, svc_id, task_id):
     route = "%s/v1/environments/%s/services/%s/console/status/%s" % (config.paas_host, env_id, svc_id, task_id)
     return session.get(route, verify = True)
 
-def poll_console_job(session, env_id, svc_id, task_id):
+def poll_console_job(session, env_id, svc_id, task_id, progress = True, timeout = None):
+    """Waits for the console task to get a job and returns its ID, or None if it has none after timeout seconds."""
+    started = time.time()
     while True:
         resp = console_job_status(session, env_id, svc_id, task_id)
         if resp["jobId"] is not None:
             return resp["jobId"]
+        if timeout is not None and time.time() - started >= timeout:
+            return None
         time.sleep(2)
-        output.write(".", sameline = True)
+        if progress:
+            output.write(".", sameline = True)
 
 def get_console_tokens(session, env_id, svc_id, job_id):
     route = "%s/v1/environments/%s/services/%s/console/token/%s" % (config.paas_host, env_id, svc_id, job_id)
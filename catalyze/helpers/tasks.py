@@ -14,5 +14,70 @@ def poll_status(session, env_id, task_id, exit_on_error=True):
             else:
                 output.write("")
                 output.error("Error - ended in status '%s'." % (task["status"],), exit=exit_on_error)
+                return task
         else:
             output.write(".", sameline = True)
+
+def retrieve(session, env_id, task_id):
+    route = "%s/v1/environments/%s/tasks/%s" % (config.paas_host, env_id, task_id)
+    return session.get(route, verify = True)
+
+def wait(session, env_id, task_id, interval = 2, timeout = None):
+    """Like poll_status, but silent and without exiting: returns the task once it has ended in any status, or None
+    if it is still running after timeout seconds."""
+    started = time.time()
+    while True:
+        time.sleep(interval)
+        task = retrieve(session, env_id, task_id)
+        if task["status"] not in ["scheduled", "queued", "started", "running"]:
+            return task
+        if timeout is not None and time.time() - started >= timeout:
+            return None
+
+def launch_many(session, env_id, names, start, max_workers, track, timeout = None):
+    """
+    Starts a task for every name concurrently and prints a summary.
+
+    :param start: called with each name to start its task, returning the API response
+    :param track: whether to wait for every task to end, reporting its final status and duration. A task that cannot
+        be tracked because the response has no task ID, or that is still running after timeout seconds, counts as
+        failed
+    :return: the number of tasks that failed to start or did not finish
+    """
+    def run(name):
+        started = time.time()
+        resp = start(name)
+        task_id = (resp or {}).get("taskId") or (resp or {}).get("id")
+        if not track:
+            return task_id, None, None
+        if task_id is None:
+            return task_id, "untracked", None
+        task = wait(session, env_id, task_id, timeout = timeout)
+        return task_id, task["status"] if task is not None else "timed out", time.time() - started
+
+    failures = 0
+    for name, (result, error) in zip(names, session.map_calls(run, names, max_workers = max_workers)):
+        if error is not None:
+            failures += 1
+            output.record({"name": name, "status": "not started", "error": str(error)},
+                    "%s: failed to start (%s)" % (name, error if not isinstance(error, SystemExit) else "see above"))
+            continue
+        task_id, status, duration = result
+        if status == "untracked":
+            failures += 1
+            output.record({"name": name, "taskId": None, "status": status},
+                    "%s: started, but could not be tracked (no task ID was returned)" % (name,))
+        elif status is None:
+            output.record({"name": name, "taskId": task_id, "status": "started"},
+                    "%s: started%s" % (name, "" if task_id is None else " (task ID = %s)" % (task_id,)))
+        else:
+            if status != "finished":
+                failures += 1
+            output.record({"name": name, "taskId": task_id, "status": status, "seconds": duration},
+                    "%s: %s after %.0fs (task ID = %s)" % (name, status, duration, task_id))
+    output.write("%d of %d succeeded" % (len(names) - failures, len(names)))
+    return failures
+
+def read_names(file):
+    """Reads one name per line from a file, skipping blank lines and # comments."""
+    return [line.strip() for line in file if line.strip() and not line.strip().startswith("#")]
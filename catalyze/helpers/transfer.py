@@ -0,0 +1,184 @@
+from __future__ import absolute_import
+
+from catalyze import config, output
+from catalyze.helpers import AESCrypto
+import os, sys, time
+
+def parse_rate(value):
+    """
+    Parses a transfer rate in bytes per second, such as "1048576", "500K" or "2M" (K, M and G are powers of 1024).
+    """
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    number = value.strip().upper()
+    if number.endswith("B"):
+        number = number[:-1]
+    multiplier = units.get(number[-1:], 1)
+    if number[-1:] in units:
+        number = number[:-1]
+    rate = int(float(number) * multiplier)
+    if rate <= 0:
+        raise ValueError("The rate must be positive")
+    return rate
+
+def format_size(size):
+    return "%.1f MB" % (size / 1024.0 / 1024.0,)
+
+def format_rate(rate):
+    return "%.2f MB/s" % (rate / 1024.0 / 1024.0,)
+
+class TokenBucket(object):
+    """
+    Limits throughput to rate bytes per second. The bucket starts empty and holds at most a tenth of a second's
+    worth, so not even the start of a transfer can burst past the rate.
+    """
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self.capacity = self.rate / 10
+        self.tokens = 0.0
+        self.updated = time.time()
+
+    def consume(self, amount):
+        """Takes amount tokens, first sleeping for as long as it takes the bucket to cover them."""
+        now = time.time()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= amount
+        if self.tokens < 0:
+            time.sleep(-self.tokens / self.rate)
+
+class Transfer(object):
+    """
+    Meters one upload or download. Every block is counted through add(), which applies config.limit_rate and
+    redraws a progress line (bytes, MB/s and ETA) on stderr when it is a terminal. finish() prints the average and
+    peak network throughput and how the time split between the network and encryption or decryption.
+    """
+    def __init__(self, verb, crypto_label, total = None):
+        """
+        :param verb: how the summary describes the transfer ("Uploaded", "Downloaded")
+        :param crypto_label: how the summary describes the time not spent on the network ("encryption", "decryption")
+        :param total: the number of bytes to transfer, if known, for the ETA
+        """
+        self.verb = verb
+        self.crypto_label = crypto_label
+        self.total = total
+        self.done = 0
+        self.started = time.time()
+        self.network_seconds = None
+        self.crypto_seconds = None
+        self.bucket = TokenBucket(config.limit_rate) if config.limit_rate else None
+        self.window_started = self.started
+        self.window_bytes = 0
+        self.peak = 0.0
+        self.drawn = 0
+        try:
+            self.interactive = sys.stderr.isatty()
+        except AttributeError:
+            self.interactive = False
+
+    def begin(self):
+        """Restarts the clock, for a Transfer created before the data started moving."""
+        self.started = self.window_started = time.time()
+
+    def add(self, amount):
+        """Counts amount bytes moved over the network, sleeping first if they would exceed the rate limit."""
+        if self.bucket is not None:
+            self.bucket.consume(amount)
+        self.done += amount
+        now = time.time()
+        self.window_bytes += amount
+        if now - self.window_started >= 1:
+            self.peak = max(self.peak, self.window_bytes / (now - self.window_started))
+            self.window_started = now
+            self.window_bytes = 0
+        if self.interactive and now - self.drawn >= 0.25:
+            self.drawn = now
+            self.draw(now)
+
+    def track(self, chunks):
+        """Meters an iterable of downloaded chunks. Only the time spent waiting for chunks counts as network time."""
+        self.network_seconds = 0.0
+        self.begin()
+        iterator = iter(chunks)
+        while True:
+            started = time.time()
+            chunk = next(iterator, None)
+            if chunk is None:
+                return
+            self.add(len(chunk))
+            self.network_seconds += time.time() - started
+            yield chunk
+
+    def draw(self, now):
+        elapsed = max(now - self.started, 0.001)
+        rate = self.done / elapsed
+        line = "%s %s" % (format_size(self.done), "of " + format_size(self.total) if self.total else "")
+        line = "%s  %s" % (line.rstrip(), format_rate(rate))
+        if self.total and rate > 0:
+            remaining = max(self.total - self.done, 0) / rate
+            line += "  ETA %d:%02d" % (remaining // 60, remaining % 60)
+        sys.stderr.write("\r" + line.ljust(60))
+        sys.stderr.flush()
+
+    def finish(self):
+        """
+        Clears the progress line and prints the summary. Unless they were set, the network time is the time since
+        the transfer started and the encryption or decryption time is whatever the network time leaves of it.
+        """
+        elapsed = time.time() - self.started
+        if self.interactive and self.drawn:
+            sys.stderr.write("\r" + " " * 60 + "\r")
+            sys.stderr.flush()
+        network = self.network_seconds if self.network_seconds is not None else elapsed
+        crypto = self.crypto_seconds if self.crypto_seconds is not None else max(elapsed - network, 0)
+        average = self.done / network if network > 0 else 0
+        peak = max(self.peak, average)
+        output.write("%s %s: average %s, peak %s (network %.1fs, %s %.1fs)" % (self.verb, format_size(self.done),
+                format_rate(average), format_rate(peak), network, self.crypto_label, crypto))
+
+class MeteredFile(object):
+    """
+    Wraps a file for upload so that every block read from it is counted by a Transfer. requests sends its length
+    as the Content-Length.
+    """
+    def __init__(self, file, transfer):
+        self.file = file
+        self.transfer = transfer
+        self.size = os.fstat(file.fileno()).st_size - file.tell()
+        transfer.total = self.size
+        transfer.begin()
+
+    def __len__(self):
+        return self.size
+
+    def read(self, size = -1):
+        data = self.file.read(size)
+        self.transfer.add(len(data))
+        return data
+
+def download_decrypted(session, url, key, iv, filepath):
+    """
+    Downloads an encrypted backup and decrypts it to filepath as it arrives, so decryption overlaps the transfer and
+    the ciphertext never touches the disk. If filepath is "-", the plaintext is streamed to stdout instead.
+
+    :param key: the base64 encoded key from the job
+    :param iv: the base64 encoded IV from the job
+    """
+    r = session.get_file(url)
+    transfer = Transfer("Downloaded", "decryption", total = int(r.headers.get("Content-Length") or 0) or None)
+    decryption = AESCrypto.Decryption(None, key, iv)
+    chunks = transfer.track(r.iter_content(chunk_size=AESCrypto.chunk_size()))
+    if filepath == "-":
+        decryption.decrypt_stream(chunks, sys.stdout)
+        sys.stdout.flush()
+        transfer.crypto_seconds = decryption.seconds
+        transfer.finish()
+        return
+    try:
+        with open(filepath, 'wb') as f:
+            decryption.decrypt_stream(chunks, f)
+    except BaseException:
+        if os.path.isfile(filepath):
+            os.remove(filepath)
+        raise
+    transfer.crypto_seconds = decryption.seconds
+    transfer.finish()
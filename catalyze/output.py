@@ -1,13 +1,49 @@
 from __future__ import absolute_import
 
-import sys
+import sys, json
+
+# When stdout is not a terminal, writes to it are left in the stream's buffer and only flushed for progress updates
+# (sameline writes), explicit flushes, errors and at exit.
+try:
+    buffered = not sys.stdout.isatty()
+except AttributeError:
+    buffered = False
+
+# In JSON mode, results are written to stdout as one JSON document per line via record(), and all other messages
+# go to stderr so that stdout can be parsed as-is.
+json_mode = False
+
+# Set by reserve_stdout() when a command streams data to stdout; every message and record then goes to stderr.
+stdout_reserved = False
+
+def reserve_stdout():
+    global stdout_reserved
+    stdout_reserved = True
 
 def write(*args, **kwargs):
-    stream = kwargs["stream"] if "stream" in kwargs else sys.stdout
-    stream.write(" ".join([str(v) for v in args]) + ("\n" if "sameline" not in kwargs or not kwargs["sameline"] else ""))
-    stream.flush()
+    stream = kwargs["stream"] if "stream" in kwargs else (sys.stderr if json_mode or stdout_reserved else sys.stdout)
+    sameline = "sameline" in kwargs and kwargs["sameline"]
+    stream.write(" ".join([str(v) for v in args]) + ("\n" if not sameline else ""))
+    if stream is not sys.stdout or not buffered or sameline or ("flush" in kwargs and kwargs["flush"]):
+        stream.flush()
+
+def record(data, text = None):
+    """
+    Emits a single result. In JSON mode data is written to stdout as one line of JSON; otherwise text is written
+    (nothing is written if text is None).
+    """
+    if json_mode:
+        write(json.dumps(data), stream = sys.stdout if not stdout_reserved else sys.stderr)
+    elif text is not None:
+        write(text)
+
+def flush():
+    sys.stdout.flush()
 
 def error(message, exit = True, exit_code = -1):
+    flush()
+    if json_mode and not stdout_reserved:
+        write(json.dumps({"error": str(message)}), stream = sys.stdout, flush = True)
     write("ERROR: " + str(message), stream = sys.stderr)
     if exit:
         sys.exit(exit_code)
@@ -0,0 +1,40 @@
+from __future__ import absolute_import
+
+import threading
+
+default_workers = 8
+
+def map(func, items, max_workers = default_workers):
+    """
+    Calls func once per item on a bounded set of threads and waits for all of them to finish.
+
+    :param func: the function to call with each item
+    :param items: the items to process
+    :param max_workers: the maximum number of calls in flight at once
+    :return: a list of (result, error) tuples in the same order as items. error is None on success, otherwise the
+        exception raised by that call (including the SystemExit raised by output.error)
+    """
+    items = [item for item in items]
+    results = [None] * len(items)
+    lock = threading.Lock()
+    remaining = iter(range(len(items)))
+
+    def worker():
+        while True:
+            with lock:
+                index = next(remaining, None)
+            if index is None:
+                return
+            try:
+                results[index] = (func(items[index]), None)
+            except BaseException as e:
+                results[index] = (None, e)
+
+    threads = [threading.Thread(target = worker) for i in range(max(1, min(max_workers, len(items))))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(0.5)
+    return results
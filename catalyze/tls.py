@@ -0,0 +1,109 @@
+from __future__ import absolute_import
+
+import atexit, select, ssl, sys, threading, time
+import OpenSSL.SSL
+from requests.packages.urllib3 import connection
+from requests.packages.urllib3.contrib import pyopenssl
+
+# The cache relies on private parts of pyOpenSSL and of urllib3's pyOpenSSL support (as in requests 2.7).
+# install() checks for all of them before hooking anything, and otherwise leaves urllib3 alone.
+try:
+    from OpenSSL._util import lib as _lib
+except ImportError:
+    _lib = None
+REQUIRED = ["ssl_wrap_socket", "_openssl_versions", "_openssl_verify", "_verify_callback", "DEFAULT_SSL_CIPHER_LIST",
+        "WrappedSocket", "timeout"]
+
+class SessionCache(object):
+    """
+    Replaces urllib3's pyOpenSSL socket wrapper so that connections share SSL contexts (the CA bundle is loaded
+    once rather than per connection) and each new connection to a host offers the last TLS session negotiated with
+    it. Only the first connection to each host then needs a full handshake; the rest, such as the parallel
+    connections opened by catalyze.pool or a reconnect after a dropped keep-alive, are abbreviated.
+
+    Sessions live for the length of the process: neither pyOpenSSL nor Python 2's ssl module can serialize one.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.contexts = {}
+        self.sessions = {}
+        self.handshakes = 0
+        self.resumed = 0
+        self.seconds = 0.0
+
+    def context(self, keyfile, certfile, cert_reqs, ca_certs, ssl_version):
+        key = (keyfile, certfile, cert_reqs, ca_certs, ssl_version)
+        with self.lock:
+            if key not in self.contexts:
+                ctx = OpenSSL.SSL.Context(pyopenssl._openssl_versions[ssl_version])
+                if certfile:
+                    keyfile = keyfile or certfile
+                    ctx.use_certificate_file(certfile)
+                if keyfile:
+                    ctx.use_privatekey_file(keyfile)
+                if cert_reqs != ssl.CERT_NONE:
+                    ctx.set_verify(pyopenssl._openssl_verify[cert_reqs], pyopenssl._verify_callback)
+                if ca_certs:
+                    try:
+                        ctx.load_verify_locations(ca_certs, None)
+                    except OpenSSL.SSL.Error as e:
+                        raise ssl.SSLError("bad ca_certs: %r" % ca_certs, e)
+                else:
+                    ctx.set_default_verify_paths()
+                ctx.set_options(OpenSSL.SSL.OP_NO_COMPRESSION)
+                ctx.set_cipher_list(pyopenssl.DEFAULT_SSL_CIPHER_LIST)
+                self.contexts[key] = ctx
+            return self.contexts[key]
+
+    def wrap_socket(self, sock, keyfile = None, certfile = None, cert_reqs = None, ca_certs = None, server_hostname = None,
+            ssl_version = None):
+        cnx = OpenSSL.SSL.Connection(self.context(keyfile, certfile, cert_reqs, ca_certs, ssl_version), sock)
+        cnx.set_tlsext_host_name(server_hostname)
+        key = (server_hostname, cert_reqs, ssl_version)
+        with self.lock:
+            session = self.sessions.get(key)
+        if session is not None:
+            cnx.set_session(session)
+        cnx.set_connect_state()
+        started = time.time()
+        while True:
+            try:
+                cnx.do_handshake()
+            except OpenSSL.SSL.WantReadError:
+                rd, _, _ = select.select([sock], [], [], sock.gettimeout())
+                if not rd:
+                    raise pyopenssl.timeout("select timed out")
+                continue
+            except OpenSSL.SSL.Error as e:
+                raise ssl.SSLError("bad handshake", e)
+            break
+        with self.lock:
+            self.handshakes += 1
+            self.resumed += 1 if _lib.SSL_session_reused(cnx._ssl) else 0
+            self.seconds += time.time() - started
+            self.sessions[key] = cnx.get_session()
+        return pyopenssl.WrappedSocket(cnx, sock)
+
+    def report(self):
+        sys.stderr.write("TLS handshakes: %d (%d resumed) in %.1f ms\n" % (self.handshakes, self.resumed, self.seconds * 1000))
+
+sessions = SessionCache()
+
+def install(report = False):
+    """
+    Routes every new HTTPS connection through the session cache. Only urllib3 versions whose pyOpenSSL support
+    wraps sockets with a plain function can be hooked; with others nothing changes and every connection makes a
+    full handshake.
+
+    :param report: print the handshake count and time to stderr at exit, or why the cache could not be installed
+    """
+    missing = [name for name in REQUIRED if not hasattr(pyopenssl, name)]
+    if _lib is None or not hasattr(_lib, "SSL_session_reused"):
+        missing.append("OpenSSL._util.lib.SSL_session_reused")
+    if len(missing) > 0:
+        if report:
+            sys.stderr.write("TLS session reuse is unavailable: this version of requests/pyOpenSSL lacks %s\n" % (", ".join(missing),))
+        return
+    connection.ssl_wrap_socket = sessions.wrap_socket
+    if report:
+        atexit.register(sessions.report)